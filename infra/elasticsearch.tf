@@ -171,6 +171,7 @@ resource "aws_lambda_function" "entity_processor" {
   source_code_hash = data.archive_file.entity_processor_zip.output_base64sha256
   timeout          = 300
   memory_size      = 1024
+  layers           = [aws_lambda_layer_version.nltk_data.arn]
 
   environment {
     variables = {
@@ -231,6 +232,22 @@ resource "aws_lambda_event_source_mapping" "entity_processor_trigger" {
   function_name    = aws_lambda_function.entity_processor.function_name
   batch_size       = 10
   enabled          = true
+
+  # The handler returns batchItemFailures, so only failed messages are retried
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+# Install the entity index templates, mappings and merge scripts on deploy, so the
+# processor does not manage indices while handling documents
+resource "aws_lambda_invocation" "entity_processor_bootstrap" {
+  function_name = aws_lambda_function.entity_processor.function_name
+  input         = jsonencode({ action = "bootstrap_indices" })
+
+  triggers = {
+    source_code_hash = data.archive_file.entity_processor_zip.output_base64sha256
+  }
+
+  depends_on = [aws_elasticsearch_domain.entity_graph]
 }
 
 # Zip files for Lambda functions
@@ -243,6 +260,21 @@ data "archive_file" "entity_processor_zip" {
   }
 }
 
+# NLTK data of the entity processor, mounted at /opt/nltk_data. Build it first with
+#   python lambda/bundle_nltk_data.py --target lambda/build/layer/nltk_data
+data "archive_file" "nltk_data_layer_zip" {
+  type        = "zip"
+  output_path = "${path.module}/nltk_data_layer.zip"
+  source_dir  = "${path.module}/lambda/build/layer"
+}
+
+resource "aws_lambda_layer_version" "nltk_data" {
+  layer_name          = "detector-gadget-nltk-data"
+  filename            = data.archive_file.nltk_data_layer_zip.output_path
+  source_code_hash    = data.archive_file.nltk_data_layer_zip.output_base64sha256
+  compatible_runtimes = ["python3.9"]
+}
+
 data "archive_file" "poi_graph_generator_zip" {
   type        = "zip"
   output_path = "${path.module}/poi_graph_generator.zip"
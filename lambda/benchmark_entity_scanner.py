@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark the combined entity scanner in entity_processor against the
+previous extraction path, which ran re.findall once per entry in PATTERNS.
+
+Run from the lambda directory:
+
+    python benchmark_entity_scanner.py --size-mb 5 --repeat 3
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import entity_processor  # noqa: E402
+
+WORDS = (
+    'the quarterly invoice was approved by finance after review of the attached '
+    'statement please confirm receipt and forward to legal counsel before friday'
+).split()
+
+def legacy_extract_entities(content):
+    """The per-pattern extraction path the combined scanner replaced"""
+    entities = {}
+    for entity_type, pattern in entity_processor.PATTERNS.items():
+        matches = re.findall(pattern, content)
+        if matches:
+            unique_matches = []
+            for match in matches:
+                normalized = entity_processor.normalize_entity(entity_type, match)
+                if normalized and normalized not in unique_matches:
+                    unique_matches.append(normalized)
+            if unique_matches:
+                entities[entity_type] = unique_matches
+    return entities
+
+def random_entity(rng):
+    """Return one synthetic entity string of a random type"""
+    user = ''.join(rng.choice('abcdefghij') for _ in range(6))
+    host = f"{''.join(rng.choice('klmnopqrst') for _ in range(7))}.example.com"
+    return rng.choice([
+        f'{user}@{host}',
+        f'https://{host}/path/{user}.html?id={rng.randint(1, 999)}',
+        f'{rng.randint(1, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}',
+        f'({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(1000, 9999)}',
+        f'4111-1111-1111-{rng.randint(1000, 9999)}',
+        f'{rng.randint(100, 899)}-{rng.randint(10, 99)}-{rng.randint(1000, 9999)}',
+        f'@{user}',
+        host,
+    ])
+
+def build_corpus(size_bytes, seed=0):
+    """Build a prose-like document of roughly size_bytes with embedded entities"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size_bytes:
+        sentence = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+        if rng.random() < 0.3:
+            sentence.insert(rng.randrange(len(sentence)), random_entity(rng))
+        text = ' '.join(sentence).capitalize() + '. '
+        parts.append(text)
+        length += len(text)
+    return ''.join(parts)
+
+def best_time(fn, content, repeat):
+    """Return the fastest of repeat runs of fn(content) and its last result"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=2.0, help='size of the synthetic document')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per path, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    content = build_corpus(int(args.size_mb * 1024 * 1024), args.seed)
+    size_mb = len(content) / (1024 * 1024)
+
+    legacy_time, legacy = best_time(legacy_extract_entities, content, args.repeat)
+    combined_time, combined = best_time(entity_processor.extract_entities, content, args.repeat)
+
+    print(f"document: {size_mb:.2f} MB")
+    print(f"{'path':<10} {'seconds':>10} {'MB/s':>10}")
+    print(f"{'legacy':<10} {legacy_time:>10.3f} {size_mb / legacy_time:>10.2f}")
+    print(f"{'combined':<10} {combined_time:>10.3f} {size_mb / combined_time:>10.2f}")
+    print(f"speedup: {legacy_time / combined_time:.2f}x")
+
+    print(f"\n{'type':<12} {'legacy':>8} {'combined':>9} {'legacy only':>12} {'combined only':>14}")
+    for entity_type in entity_processor.PATTERNS:
+        old_values = set(legacy.get(entity_type, []))
+        new_values = set(combined.get(entity_type, []))
+        print(f"{entity_type:<12} {len(old_values):>8} {len(new_values):>9} "
+              f"{len(old_values - new_values):>12} {len(new_values - old_values):>14}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Download the NLTK data entity_processor needs into a local directory, so the
+function starts without network access to the NLTK servers.
+
+Bundle it next to entity_processor.py (the default target) for local runs,
+or build the contents of the Lambda layer Terraform deploys (mounted under
+/opt):
+
+    python bundle_nltk_data.py
+    python bundle_nltk_data.py --target build/layer/nltk_data
+
+entity_processor only downloads missing data when NLTK_ALLOW_DOWNLOAD=true.
+"""
+
+import argparse
+import os
+import sys
+
+import nltk
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import entity_processor  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data'),
+                        help='directory to download the data into')
+    args = parser.parse_args()
+
+    resources = entity_processor.required_nltk_resources()
+    for package in resources:
+        if not nltk.download(package, download_dir=args.target, quiet=True):
+            sys.exit(f"failed to download {package}")
+
+    # Check the data loads from the target alone, as it will in Lambda
+    nltk.data.path[:] = [args.target]
+    for resource in resources.values():
+        nltk.data.find(resource)
+    print(f"bundled {', '.join(resources)} into {args.target}")
+
+if __name__ == '__main__':
+    main()
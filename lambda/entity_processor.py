@@ -1,36 +1,225 @@
+import time
+
+# Cold-start phases of this container in milliseconds, logged once by the
+# first invocation; imports are timed from here
+STARTUP_TIMINGS = {}
+_startup_started = time.perf_counter()
+_startup_reported = False
+
 import os
 import json
 import boto3
 import logging
 import requests
 import re
-import uuid
+import random
+import sqlite3
+import base64
+import hashlib
+import threading
+import codecs
+import gzip
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
 from botocore.exceptions import ClientError
 from urllib.parse import unquote_plus
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-import nltk
-from nltk.sentiment import SentimentIntensityAnalyzer
+
+STARTUP_TIMINGS['imports'] = round((time.perf_counter() - _startup_started) * 1000, 1)
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Download NLTK resources
-nltk.download('punkt', download_dir='/tmp')
-nltk.download('vader_lexicon', download_dir='/tmp')
-nltk.data.path.append('/tmp')
+@contextmanager
+def startup_phase(name):
+    """Record the duration of a one-time initialization step"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round((time.perf_counter() - started) * 1000, 1)
+
+# Get environment variables. They are set on the function; importing this
+# module without them (tests, the scripts next to it) has no side effects
+ES_ENDPOINT = os.environ.get('ELASTICSEARCH_ENDPOINT', '')
+ES_USERNAME = os.environ.get('ELASTICSEARCH_USERNAME', '')
+ES_PASSWORD = os.environ.get('ELASTICSEARCH_PASSWORD', '')
+EVIDENCE_BUCKET = os.environ.get('EVIDENCE_BUCKET', '')
+ARTIFACTS_BUCKET = os.environ.get('ARTIFACTS_BUCKET', '')
+
+# Elasticsearch _bulk settings: documents and bytes per request (below the
+# 10 MiB http.max_content_length of small Amazon Elasticsearch instances),
+# retries of items the cluster rejected transiently, and the base of the
+# exponential backoff
+ES_BULK_SIZE = int(os.environ.get('ES_BULK_SIZE', '500'))
+ES_BULK_MAX_BYTES = int(os.environ.get('ES_BULK_MAX_BYTES', '10000000'))
+ES_BULK_MAX_RETRIES = int(os.environ.get('ES_BULK_MAX_RETRIES', '3'))
+ES_BULK_BACKOFF = float(os.environ.get('ES_BULK_BACKOFF', '0.5'))
+ES_POOL_SIZE = int(os.environ.get('ES_POOL_SIZE', '10'))
+ES_TIMEOUT = int(os.environ.get('ES_TIMEOUT', '30'))
+# Items worth resending: version conflicts left after retry_on_conflict,
+# rejections by a full write queue and unavailable nodes
+RETRYABLE_STATUSES = {409, 429, 502, 503, 504}
+
+# HTTP session shared by all Elasticsearch requests of a warm container
+_http_session = None
+# S3 client of a warm container, created by the first invocation
+_s3_client = None
+
+# Entity documents keep at most this many recent occurrences (contexts); the
+# counters still cover all of them
+ES_MAX_OCCURRENCES = int(os.environ.get('ES_MAX_OCCURRENCES', '100'))
 
-# Initialize clients
-s3 = boto3.client('s3')
-sqs = boto3.client('sqs')
+# Sources remembered per entity and relationship document, newest last. A
+# source seen again (a redelivered message, a re-uploaded object) replaces its
+# earlier contribution; older sources are forgotten, keeping updates O(1)
+ES_MAX_SOURCES = int(os.environ.get('ES_MAX_SOURCES', '100'))
+
+# Painless scripts merging one source document's results into the entity and
+# relationship documents. The totals are updated incrementally; recent_sources
+# (not indexed) holds the contributions of the last ES_MAX_SOURCES sources.
+# This prefix leaves the earlier contribution of params.source_id, if it is
+# still remembered, in prior and records the new one.
+RECENT_SOURCE_SCRIPT = """
+Map s = ctx._source;
+String sid = params.source_id;
+Map stats = params.stats;
+if (s.recent_sources == null) { s.recent_sources = new ArrayList(); }
+Map prior = null;
+for (int i = 0; i < s.recent_sources.size(); i++) {
+  if (sid.equals(s.recent_sources[i].source_id)) { prior = s.recent_sources.remove(i); break; }
+}
+s.recent_sources.add(['source_id': sid, 'stats': stats]);
+if (s.recent_sources.size() > params.max_sources) { s.recent_sources.remove(0); }
+"""
+
+ENTITY_MERGE_SCRIPT = RECENT_SOURCE_SCRIPT + """
+if (s.occurrence_count == null) {
+  s.sentiment = ['positive': 0L, 'negative': 0L, 'neutral': 0L];
+  s.occurrence_count = 0L; s.mention_count = 0L; s.document_count = 0L; s.sentiment_sum = 0.0;
+} else if (s.sentiment_sum == null) {
+  s.sentiment_sum = s.average_sentiment * s.occurrence_count;
+  s.remove('sources');
+}
+if (prior == null) {
+  s.document_count += 1;
+} else {
+  Map p = prior.stats;
+  s.sentiment.positive -= p.positive; s.sentiment.negative -= p.negative; s.sentiment.neutral -= p.neutral;
+  s.occurrence_count -= p.occurrences; s.mention_count -= p.mentions; s.sentiment_sum -= p.sentiment_sum;
+}
+s.sentiment.positive += stats.positive; s.sentiment.negative += stats.negative; s.sentiment.neutral += stats.neutral;
+s.occurrence_count += stats.occurrences; s.mention_count += stats.mentions; s.sentiment_sum += stats.sentiment_sum;
+s.average_sentiment = s.occurrence_count > 0 ? s.sentiment_sum / s.occurrence_count : 0;
+if (s.occurrences == null) { s.occurrences = new ArrayList(); }
+s.occurrences.removeIf(o -> sid.equals(o.source_id));
+s.occurrences.addAll(params.occurrences);
+int extra = s.occurrences.size() - params.max_occurrences;
+if (extra > 0) { s.occurrences.subList(0, extra).clear(); }
+s.metadata = params.metadata;
+s.processed_at = params.processed_at;
+"""
+
+RELATIONSHIP_MERGE_SCRIPT = RECENT_SOURCE_SCRIPT + """
+if (s.strength == null) {
+  s.strength = 0L; s.document_count = 0L; s.sentiment_sum = 0.0;
+} else if (s.sentiment_sum == null) {
+  s.sentiment_sum = s.sentiment * s.strength;
+  s.remove('sources');
+}
+if (prior == null) {
+  s.document_count += 1;
+} else {
+  s.strength -= prior.stats.strength; s.sentiment_sum -= prior.stats.sentiment_sum;
+}
+s.strength += stats.strength; s.sentiment_sum += stats.sentiment_sum;
+s.sentiment = s.strength > 0 ? s.sentiment_sum / s.strength : 0;
+s.pair_id = params.pair_id;
+s.context_indices = params.context_indices;
+s.source_document = params.source_document;
+s.processed_at = params.processed_at;
+"""
 
-# Get environment variables
-ES_ENDPOINT = os.environ['ELASTICSEARCH_ENDPOINT']
-ES_USERNAME = os.environ['ELASTICSEARCH_USERNAME']
-ES_PASSWORD = os.environ['ELASTICSEARCH_PASSWORD']
-EVIDENCE_BUCKET = os.environ['EVIDENCE_BUCKET']
-ARTIFACTS_BUCKET = os.environ['ARTIFACTS_BUCKET']
+def stored_script_id(name, source):
+    """Id of a stored Painless script; it changes with the source, so deployments never share a script"""
+    return f"detector-gadget-{name}-{hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]}"
+
+# The merge scripts are stored in the cluster by bootstrap_indices and
+# referenced by id, so bulk updates carry only their params and the cluster
+# compiles each script once
+ENTITY_MERGE_SCRIPT_ID = stored_script_id('entity-merge', ENTITY_MERGE_SCRIPT)
+RELATIONSHIP_MERGE_SCRIPT_ID = stored_script_id('relationship-merge', RELATIONSHIP_MERGE_SCRIPT)
+ES_STORED_SCRIPTS = {
+    ENTITY_MERGE_SCRIPT_ID: ENTITY_MERGE_SCRIPT,
+    RELATIONSHIP_MERGE_SCRIPT_ID: RELATIONSHIP_MERGE_SCRIPT,
+}
+
+# Indices written by this function. They are created by the bootstrap action
+# at deploy time; ES_AUTO_BOOTSTRAP lets the processing path create them instead
+ES_INDICES = ('entities', 'relationships', 'processed_content')
+ES_AUTO_BOOTSTRAP = os.environ.get('ES_AUTO_BOOTSTRAP', 'false').lower() == 'true'
+_indices_ready = False
+
+# NLTK data is looked up in these directories first: nltk_data next to this
+# module (see bundle_nltk_data.py) and the Lambda layer mounted at /opt. Missing
+# resources are downloaded to /tmp only when NLTK_ALLOW_DOWNLOAD is true, which
+# is meant for local runs; deployments get the data from the layer.
+NLTK_DATA_DIRS = os.environ.get(
+    'NLTK_DATA_DIRS',
+    f"{os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data')}:/opt/nltk_data"
+).split(':')
+NLTK_ALLOW_DOWNLOAD = os.environ.get('NLTK_ALLOW_DOWNLOAD', 'false').lower() == 'true'
+NLTK_DOWNLOAD_DIR = '/tmp/nltk_data'
+_nltk_ready = False
+
+# Sentiment analyzer and sentence tokenizer, built on first use
+_sentiment_analyzer = None
+_sentence_tokenizer = None
+
+# Sentiment scores of recently seen sentences keyed by content hash, kept
+# across invocations of a warm container (signatures, disclaimers, ...)
+SENTIMENT_CACHE_SIZE = int(os.environ.get('SENTIMENT_CACHE_SIZE', '10000'))
+_sentiment_cache = OrderedDict()
+_sentiment_cache_lock = threading.Lock()
+
+# S3 objects of one invocation processed at the same time; they share the
+# HTTP session, so ES_POOL_SIZE should not be smaller
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '4'))
+
+# Registry of analyzed content, so re-uploaded or copied evidence is linked
+# to its existing artifact instead of being processed again:
+# 'elasticsearch' (the processed_content index), 'sqlite:<path>' for a
+# local stand-in, or 'none'
+CONTENT_REGISTRY = os.environ.get('CONTENT_REGISTRY', 'elasticsearch')
+_content_registry = None
+
+# Analysis artifacts are written as gzipped JSON-lines sections ('compact')
+# unless ARTIFACT_FORMAT is 'json'
+ARTIFACT_FORMAT = os.environ.get('ARTIFACT_FORMAT', 'compact')
+ARTIFACT_SECTIONS = ('summary', 'sentences', 'entities', 'occurrences', 'relationships')
+COMPACT_ARTIFACT_VERSION = 1
+
+# Objects larger than STREAM_THRESHOLD_BYTES are read in STREAM_CHUNK_BYTES
+# chunks and analyzed in windows of about STREAM_WINDOW_CHARS characters
+# instead of being decoded whole
+STREAM_THRESHOLD_BYTES = int(os.environ.get('STREAM_THRESHOLD_BYTES', str(32 * 1024 * 1024)))
+STREAM_WINDOW_CHARS = int(os.environ.get('STREAM_WINDOW_CHARS', str(4 * 1024 * 1024)))
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+# Sentences longer than this, such as log files the tokenizer returns as one
+# sentence, are split at every line break and then at spaces
+MAX_SENTENCE_CHARS = int(os.environ.get('MAX_SENTENCE_CHARS', '4096'))
+
+# Sentences with more entities than this (CSV rows, address lists) only pair
+# up a sample of them, bounding the quadratic number of relationship pairs
+MAX_ENTITIES_PER_SENTENCE = int(os.environ.get('MAX_ENTITIES_PER_SENTENCE', '50'))
 
 # Entity patterns
 PATTERNS = {
@@ -44,97 +233,370 @@ PATTERNS = {
     'domain': r'\b(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}\b'
 }
 
+# Cheap guards placed in front of the backtracking-heavy patterns in the
+# combined scanner. email only starts at the beginning of a run of local-part
+# characters and domain only where a label is followed by a dot, which skips
+# the attempts that cannot match without changing what is found.
+PATTERN_GUARDS = {
+    'email': r'(?<![a-zA-Z0-9_.+-])(?=[a-zA-Z0-9_.+-]+@)',
+    'domain': r'(?=[a-zA-Z0-9-]+\.[a-zA-Z0-9])'
+}
+
+# Alternation order of the combined scanner; where matches of several types
+# start at the same position the earlier type claims the text
+SCAN_ORDER = ['url', 'email', 'ip_address', 'credit_card', 'ssn', 'phone', 'username', 'domain']
+
+with startup_phase('patterns'):
+    # All entity patterns compiled once into a single alternation of named groups
+    ENTITY_SCANNER = re.compile('|'.join(
+        f"(?P<{entity_type}>{PATTERN_GUARDS.get(entity_type, '')}{PATTERNS[entity_type]})"
+        for entity_type in SCAN_ORDER
+    ))
+    DOMAIN_PATTERN = re.compile(PATTERNS['domain'])
+    
+    # Every whitespace-separated token of every entity contains one of these
+    # characters, so the scanner only needs to run over runs of such tokens
+    ANCHOR_PATTERN = re.compile(r'[@\d.:]')
+    ANCHORED_TOKENS = re.compile(r'\S*(?:\s+[^\s@\d.:]*[@\d.:]\S*)*')
+    NON_DIGITS = re.compile(r'\D')
+
 def handler(event, context):
     """Process SQS messages with S3 events, extract entities, and index to Elasticsearch"""
     logger.info("Received event: %s", json.dumps(event))
     
-    # Initialize sentiment analyzer
-    sia = SentimentIntensityAnalyzer()
+    if event.get('action') == 'bootstrap_indices':
+        results = bootstrap_indices()
+        report_startup()
+        return {
+            'statusCode': 200,
+            'body': json.dumps(results)
+        }
+    
+    # Index setup is checked on the first invocation of a container only
+    ensure_indices()
+    
+    # Sentiment analyzer shared by all invocations of this container
+    sia = get_sentiment_analyzer()
     
-    # Process each SQS message
+    # Build the shared tokenizer and S3 client before worker threads need them
+    get_sentence_tokenizer()
+    get_s3_client()
+    
+    # Collect the S3 objects of each SQS message
+    objects = []
     for record in event['Records']:
         try:
             # Parse SQS message body
             body = json.loads(record['body'])
-            
-            # Check if this is an S3 event notification
-            if 'Records' in body and body.get('Records'):
-                for s3_record in body['Records']:
-                    if s3_record.get('eventSource') == 'aws:s3' and s3_record.get('eventName').startswith('ObjectCreated'):
-                        bucket = s3_record['s3']['bucket']['name']
-                        key = unquote_plus(s3_record['s3']['object']['key'])
-                        
-                        logger.info(f"Processing S3 object: {bucket}/{key}")
-                        
-                        # Process the file content
-                        process_file(bucket, key, sia)
-            
-        except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
+        except ValueError as e:
+            # Retrying cannot fix a malformed message
+            logger.error(f"Error parsing message {record.get('messageId')}: {str(e)}")
             continue
+        
+        # Check if this is an S3 event notification
+        if 'Records' in body and body.get('Records'):
+            for s3_record in body['Records']:
+                if s3_record.get('eventSource') == 'aws:s3' and s3_record.get('eventName', '').startswith('ObjectCreated'):
+                    bucket = s3_record['s3']['bucket']['name']
+                    key = unquote_plus(s3_record['s3']['object']['key'])
+                    objects.append((record['messageId'], bucket, key))
+    
+    # Process the objects concurrently; a message is retried if any of its
+    # objects failed
+    failed_messages = set()
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+        futures = {}
+        for message_id, bucket, key in objects:
+            logger.info(f"Processing S3 object: {bucket}/{key}")
+            futures[executor.submit(process_file, bucket, key, sia)] = message_id
+        
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failed_messages.add(futures[future])
     
+    if failed_messages:
+        logger.warning(f"{len(failed_messages)} of {len(event['Records'])} messages failed and will be retried")
+    
+    report_startup()
     return {
-        'statusCode': 200,
-        'body': json.dumps('Processing complete')
+        'batchItemFailures': [
+            {'itemIdentifier': record['messageId']}
+            for record in event['Records'] if record['messageId'] in failed_messages
+        ]
     }
 
 def process_file(bucket, key, sia):
     """Process a file from S3 to extract and index entities"""
+    sentence_table = SentenceTable()
     try:
-        # Get file metadata
-        metadata = s3.head_object(Bucket=bucket, Key=key)
+        # Get file metadata, with the SHA-256 checksum if it was uploaded with one
+        metadata = get_s3_client().head_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
         content_type = metadata.get('ContentType', 'application/octet-stream')
         
-        # Get file content
-        response = s3.get_object(Bucket=bucket, Key=key)
-        content = response['Body'].read().decode('utf-8', errors='replace')
-        
-        # Extract entities
-        entities = extract_entities(content)
+        # Identical content analyzed before only needs the new key linked
+        registry = get_content_registry()
+        content_ids = metadata_content_ids(metadata)
+        if link_processed_content(registry, content_ids, bucket, key):
+            return
         
-        # Add context and sentiment analysis
-        enrich_entities(entities, content, sia)
+        # Get file content
+        response = get_s3_client().get_object(Bucket=bucket, Key=key)
+        digest = hashlib.sha256()
+        if metadata.get('ContentLength', 0) > STREAM_THRESHOLD_BYTES:
+            # Large objects are read and analyzed in bounded windows
+            chunks = hashed_chunks(response['Body'].iter_chunks(STREAM_CHUNK_BYTES), digest)
+            entities = analyze_stream(chunks, sia, sentence_table=sentence_table)
+            content_id = f"sha256:{digest.hexdigest()}"
+        else:
+            raw = response['Body'].read()
+            digest.update(raw)
+            content_id = f"sha256:{digest.hexdigest()}"
+            if content_id not in content_ids and link_processed_content(registry, [content_id], bucket, key):
+                return
+            content = raw.decode('utf-8', errors='replace')
+            del raw
+            
+            # Extract entities
+            entities = extract_entities(content)
+            
+            # Add context and sentiment analysis
+            enrich_entities(entities, content, sia, sentence_table)
         
         # Generate relationships between entities
         relationships = generate_relationships(entities)
         
         # Index entities to Elasticsearch
-        index_entities(entities, bucket, key, metadata)
+        entity_stats = index_entities(entities, bucket, key, metadata, sentence_table)
         
         # Index relationships to Elasticsearch
-        index_relationships(relationships, bucket, key)
+        relationship_stats = index_relationships(relationships, bucket, key)
+        failed = entity_stats['failed'] + relationship_stats['failed']
         
         # Create and store artifact with analysis results
-        store_analysis_results(entities, relationships, bucket, key)
+        artifact_key = store_analysis_results(entities, relationships, bucket, key, content_id, sentence_table)
+        
+        # Register the content under every id it can be looked up by, only
+        # once everything was indexed: a registered content is never
+        # processed again, so a partially indexed one must stay a miss
+        if registry and artifact_key and not failed:
+            try:
+                registry.register(sorted(set(content_ids) | {content_id}), content_id, artifact_key, bucket, key)
+            except Exception as e:
+                logger.warning(f"Error registering {content_id} for {bucket}/{key}: {str(e)}")
+        
+        # Fail the message so that SQS redelivers it; the upserts replace
+        # this document's contribution, so reprocessing it is safe
+        if failed:
+            raise RuntimeError(f"{failed} Elasticsearch documents were not indexed")
         
         logger.info(f"Successfully processed {bucket}/{key}")
         
     except Exception as e:
         logger.error(f"Error processing file {bucket}/{key}: {str(e)}")
         raise
+    finally:
+        sentence_table.close()
+
+def metadata_content_ids(metadata):
+    """Return the registry ids of an object known before reading it.
+
+    A full-object SHA-256 checksum identifies the content exactly; the ETag
+    with the size identifies it for a given upload method (single-part
+    ETags are MD5s, multipart ones depend on the part size).
+    """
+    content_ids = []
+    checksum = metadata.get('ChecksumSHA256')
+    if checksum and '-' not in checksum:
+        content_ids.append(f"sha256:{base64.b64decode(checksum).hex()}")
+    etag = metadata.get('ETag', '').strip('"')
+    if etag:
+        content_ids.append(f"etag:{etag}:{metadata.get('ContentLength', 0)}")
+    return content_ids
+
+def hashed_chunks(chunks, digest):
+    """Yield chunks, feeding them to digest on the way"""
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+def link_processed_content(registry, content_ids, bucket, key):
+    """Link bucket/key to an existing analysis of the same content.
+
+    Returns True when one was found. Registry errors are logged and treated
+    as a miss, so the object is processed normally.
+    """
+    if not registry or not content_ids:
+        return False
+    try:
+        entry = registry.lookup(content_ids)
+        if entry is None:
+            return False
+        registry.link(entry['content_id'], bucket, key)
+    except Exception as e:
+        logger.warning(f"Content registry unavailable for {bucket}/{key}: {str(e)}")
+        return False
+    
+    logger.info(f"Skipped {bucket}/{key}: content {entry['content_id']} already analyzed in {entry['artifact_key']}")
+    return True
+
+def get_content_registry():
+    """Return the configured content registry, or None when disabled"""
+    global _content_registry
+    if _content_registry is None and CONTENT_REGISTRY != 'none':
+        if CONTENT_REGISTRY.startswith('sqlite:'):
+            _content_registry = SqliteContentRegistry(CONTENT_REGISTRY[len('sqlite:'):])
+        else:
+            _content_registry = ElasticsearchContentRegistry()
+    return _content_registry
+
+class ElasticsearchContentRegistry:
+    """Content registry kept in the processed_content index.
+
+    Each id of a content gets a document holding the canonical content id,
+    the artifact key and the source objects, so lookups are realtime GETs.
+    """
+    index = 'processed_content'
+    
+    def lookup(self, content_ids):
+        response = get_http_session().post(
+            f"{ES_ENDPOINT}/{self.index}/_mget",
+            json={'ids': list(content_ids)},
+            params={'_source_includes': 'content_id,artifact_key'},
+            timeout=ES_TIMEOUT
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        for doc in response.json()['docs']:
+            if doc.get('found'):
+                return doc['_source']
+        return None
+    
+    def register(self, content_ids, content_id, artifact_key, bucket, key):
+        doc = {
+            'content_id': content_id,
+            'artifact_key': artifact_key,
+            'sources': [{'bucket': bucket, 'key': key}],
+            'processed_at': datetime.utcnow().isoformat()
+        }
+        stats = bulk_write(({'index': {'_index': self.index, '_id': doc_id}}, doc) for doc_id in content_ids)
+        if stats['failed']:
+            raise RuntimeError(f"{stats['failed']} registry documents not written")
+    
+    def link(self, content_id, bucket, key):
+        response = get_http_session().post(
+            f"{ES_ENDPOINT}/{self.index}/_update/{content_id}",
+            json={
+                'script': {
+                    'source': 'if (!ctx._source.sources.contains(params.source)) { ctx._source.sources.add(params.source) } else { ctx.op = "noop" }',
+                    'params': {'source': {'bucket': bucket, 'key': key}}
+                }
+            },
+            params={'retry_on_conflict': 3},
+            timeout=ES_TIMEOUT
+        )
+        response.raise_for_status()
+
+class SqliteContentRegistry:
+    """Content registry in a local SQLite database, for tests and single hosts"""
+    
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS content_ids '
+                              '(id TEXT PRIMARY KEY, content_id TEXT NOT NULL, artifact_key TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS content_sources '
+                              '(content_id TEXT NOT NULL, bucket TEXT NOT NULL, key TEXT NOT NULL, '
+                              'linked_at TEXT NOT NULL, PRIMARY KEY (content_id, bucket, key))')
+    
+    def lookup(self, content_ids):
+        placeholders = ','.join('?' * len(content_ids))
+        with self.lock:
+            row = self.conn.execute(
+                f'SELECT content_id, artifact_key FROM content_ids WHERE id IN ({placeholders}) LIMIT 1',
+                list(content_ids)
+            ).fetchone()
+        return {'content_id': row[0], 'artifact_key': row[1]} if row else None
+    
+    def register(self, content_ids, content_id, artifact_key, bucket, key):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO content_ids VALUES (?, ?, ?)',
+                [(doc_id, content_id, artifact_key) for doc_id in content_ids]
+            )
+        self.link(content_id, bucket, key)
+    
+    def link(self, content_id, bucket, key):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR IGNORE INTO content_sources VALUES (?, ?, ?, ?)',
+                (content_id, bucket, key, datetime.utcnow().isoformat())
+            )
+
+def candidate_windows(content):
+    """Yield (start, end) spans of content that can contain entities.
+
+    A span is a maximal run of whitespace-separated tokens that each contain
+    an anchor character; prose between them is skipped by a fast charset search.
+    """
+    pos = 0
+    while True:
+        anchor = ANCHOR_PATTERN.search(content, pos)
+        if not anchor:
+            return
+        start = anchor.start()
+        while start > pos and not content[start - 1].isspace():
+            start -= 1
+        end = ANCHORED_TOKENS.match(content, anchor.end()).end()
+        yield start, end
+        pos = end
+
+def scan_entities(content):
+    """Scan content once and yield (entity_type, match, start, end) per entity.
+
+    Text claimed by one entity is not matched again as another type, so the
+    '@host' of an email is no longer reported as a username. Hosts of emails
+    and URLs are still yielded as domains.
+    """
+    for window_start, window_end in candidate_windows(content):
+        for m in ENTITY_SCANNER.finditer(content, window_start, window_end):
+            yield from _scanned_entities(m)
+
+def _scanned_entities(m):
+    """Yield the entity for one scanner match, plus the host of an email or URL"""
+    entity_type = m.lastgroup
+    yield entity_type, m.group(), m.start(), m.end()
+
+    if entity_type == 'email':
+        host_start = m.group().index('@') + 1
+    elif entity_type == 'url':
+        host_start = m.group().index('//') + 2
+    else:
+        return
+    host = DOMAIN_PATTERN.match(m.group(), host_start)
+    if host:
+        yield 'domain', host.group(), m.start() + host.start(), m.start() + host.end()
 
 def extract_entities(content):
-    """Extract various entity types from content using regex patterns"""
-    entities = {}
+    """Extract entities from content in a single scanner pass.
+
+    Returns {entity_type: {normalized_value: [match offsets]}}; the inner
+    dicts keep first-seen order and make de-duplication O(1) per match, and
+    the offsets let enrichment find each value's sentences directly.
+    """
+    entities = {entity_type: {} for entity_type in PATTERNS}
     
-    # Apply each regex pattern to extract entities
-    for entity_type, pattern in PATTERNS.items():
-        matches = re.findall(pattern, content)
-        if matches:
-            # Deduplicate and normalize
-            unique_matches = []
-            for match in matches:
-                normalized = normalize_entity(entity_type, match)
-                if normalized and normalized not in unique_matches:
-                    unique_matches.append(normalized)
-            
-            if unique_matches:
-                entities[entity_type] = unique_matches
+    for entity_type, match, start, end in scan_entities(content):
+        # Deduplicate and normalize
+        normalized = normalize_entity(entity_type, match)
+        if normalized:
+            entities[entity_type].setdefault(normalized, []).append(start)
     
-    return entities
+    return {entity_type: values for entity_type, values in entities.items() if values}
 
 def normalize_entity(entity_type, value):
-    """Normalize entities based on their type"""
+    """Normalize entities based on their type, returning None for invalid values"""
     if not value:
         return None
         
@@ -144,50 +606,288 @@ def normalize_entity(entity_type, value):
         return value.lower()
     elif entity_type == 'phone':
         # Keep only digits
-        digits = re.sub(r'\D', '', value)
+        digits = NON_DIGITS.sub('', value)
         if len(digits) >= 10:
             return digits
         return None
     elif entity_type == 'credit_card':
         # Keep only digits
-        digits = re.sub(r'\D', '', value)
-        # Very basic validation - should be improved in production
-        if len(digits) >= 15 and len(digits) <= 16:
+        digits = NON_DIGITS.sub('', value)
+        if 15 <= len(digits) <= 16 and luhn_valid(digits):
             return digits
         return None
+    elif entity_type == 'ip_address':
+        if all(int(octet) <= 255 for octet in value.split('.')):
+            return value
+        return None
+    elif entity_type == 'ssn':
+        digits = NON_DIGITS.sub('', value)
+        if ssn_valid(digits):
+            return f"{digits[:3]}-{digits[3:5]}-{digits[5:]}"
+        return None
     elif entity_type == 'domain':
         return value.lower()
     # Add more normalization as needed
     
     return value
 
-def enrich_entities(entities, content, sia):
-    """Enrich entities with context and sentiment analysis"""
-    # Split content into sentences
-    sentences = nltk.sent_tokenize(content)
+def luhn_valid(digits):
+    """Check a string of digits against the Luhn checksum used by card numbers"""
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        digit = ord(ch) - 48
+        if i % 2:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return total % 10 == 0
+
+def ssn_valid(digits):
+    """Check the SSA rules for a 9-digit SSN: no 000, 666 or 9xx area, 00 group or 0000 serial"""
+    area, group, serial = digits[:3], digits[3:5], digits[5:]
+    return (
+        len(digits) == 9 and
+        area not in ('000', '666') and area[0] != '9' and
+        group != '00' and serial != '0000'
+    )
+
+def report_startup():
+    """Log the cold-start timing breakdown once per container"""
+    global _startup_reported
+    if _startup_reported:
+        return
+    _startup_reported = True
+    logger.info(f"Cold start timings (ms): {json.dumps(STARTUP_TIMINGS)}, "
+                f"total {round(sum(STARTUP_TIMINGS.values()), 1)}")
+
+def required_nltk_resources():
+    """Return {package: resource path} of the NLTK data this module loads"""
+    try:
+        # NLTK 3.8.2+ ships Punkt parameters as punkt_tab
+        from nltk.tokenize.punkt import PunktTokenizer  # noqa: F401
+        punkt = ('punkt_tab', 'tokenizers/punkt_tab/english/')
+    except ImportError:
+        punkt = ('punkt', 'tokenizers/punkt/english.pickle')
+    return dict([('vader_lexicon', 'sentiment/vader_lexicon.zip'), punkt])
+
+def load_nltk_data():
+    """Point NLTK at the bundled data, downloading missing resources if allowed"""
+    global _nltk_ready
+    if _nltk_ready:
+        return
+    
+    with startup_phase('nltk_data'):
+        import nltk
+        for path in reversed(NLTK_DATA_DIRS):
+            if path and path not in nltk.data.path:
+                nltk.data.path.insert(0, path)
+        
+        missing = []
+        for package, resource in required_nltk_resources().items():
+            try:
+                nltk.data.find(resource)
+            except LookupError:
+                missing.append(package)
+        
+        if missing:
+            if not NLTK_ALLOW_DOWNLOAD:
+                raise LookupError(f"NLTK data not bundled: {', '.join(missing)} (searched {', '.join(NLTK_DATA_DIRS)})")
+            logger.warning(f"Downloading NLTK data not found locally: {', '.join(missing)}")
+            for package in missing:
+                nltk.download(package, download_dir=NLTK_DOWNLOAD_DIR, quiet=True)
+            nltk.data.path.append(NLTK_DOWNLOAD_DIR)
+    _nltk_ready = True
+
+def get_sentiment_analyzer():
+    """Return the VADER sentiment analyzer, building it on first use"""
+    global _sentiment_analyzer
+    if _sentiment_analyzer is None:
+        load_nltk_data()
+        with startup_phase('sentiment_analyzer'):
+            from nltk.sentiment import SentimentIntensityAnalyzer
+            _sentiment_analyzer = SentimentIntensityAnalyzer()
+    return _sentiment_analyzer
+
+def get_sentence_tokenizer():
+    """Return the Punkt English sentence tokenizer, loading it on first use"""
+    global _sentence_tokenizer
+    if _sentence_tokenizer is None:
+        load_nltk_data()
+        with startup_phase('sentence_tokenizer'):
+            try:
+                from nltk.tokenize.punkt import PunktTokenizer
+                _sentence_tokenizer = PunktTokenizer('english')
+            except ImportError:
+                import nltk
+                _sentence_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+    return _sentence_tokenizer
+
+def cached_polarity_scores(sia, sentence):
+    """Return VADER scores for a sentence, using the content-hash LRU cache"""
+    key = hashlib.blake2b(sentence.encode('utf-8', errors='replace'), digest_size=16).digest()
+    with _sentiment_cache_lock:
+        scores = _sentiment_cache.get(key)
+        if scores is not None:
+            _sentiment_cache.move_to_end(key)
+            return scores
+    
+    scores = sia.polarity_scores(sentence)
+    if SENTIMENT_CACHE_SIZE > 0:
+        with _sentiment_cache_lock:
+            _sentiment_cache[key] = scores
+            if len(_sentiment_cache) > SENTIMENT_CACHE_SIZE:
+                _sentiment_cache.popitem(last=False)
+    return scores
+
+class SentenceTable:
+    """The context sentences of one document by document index.
+
+    enrich_sentences adds sentences as it finds occurrences; flush(before)
+    spills those with a smaller index to a temporary file, keeping only
+    their index and file offset in memory, so a streamed document holds
+    about one window of sentences at a time. Lookups read spilled
+    sentences back. A sentence added again, as the carry of a stream
+    window is, replaces the earlier text until it is flushed.
+    """
+    
+    def __init__(self):
+        self._pending = {}
+        self._indices = array('q')
+        self._offsets = array('q')
+        self._size = 0
+        self._file = None
+    
+    def __setitem__(self, index, text):
+        self._pending[index] = text
+    
+    def flush(self, before=None):
+        """Spill the sentences with an index below before, or all of them"""
+        ready = sorted(i for i in self._pending if before is None or i < before)
+        if not ready:
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        self._file.seek(self._size)
+        for index in ready:
+            text = self._pending.pop(index)
+            # Stream windows flush in index order; a lower index was
+            # spilled by the previous window already
+            if self._indices and index <= self._indices[-1]:
+                continue
+            data = text.encode('utf-8')
+            self._file.write(data)
+            self._indices.append(index)
+            self._offsets.append(self._size)
+            self._size += len(data)
+    
+    def _spilled(self, index):
+        position = bisect_left(self._indices, index)
+        if position < len(self._indices) and self._indices[position] == index:
+            return position
+        return None
+    
+    def __contains__(self, index):
+        return index in self._pending or self._spilled(index) is not None
+    
+    def __getitem__(self, index):
+        if index in self._pending:
+            return self._pending[index]
+        position = self._spilled(index)
+        if position is None:
+            raise KeyError(index)
+        start = self._offsets[position]
+        end = self._offsets[position + 1] if position + 1 < len(self._offsets) else self._size
+        self._file.seek(start)
+        return self._file.read(end - start).decode('utf-8')
+    
+    def __len__(self):
+        self.flush()
+        return len(self._indices)
+    
+    def indices(self):
+        """Return the indices of all sentences in order, spilling what is still in memory"""
+        self.flush()
+        return self._indices
+    
+    def items(self):
+        """Yield (index, sentence) in index order, spilling what is still in memory"""
+        self.flush()
+        for index in self._indices:
+            yield index, self[index]
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def enrich_entities(entities, content, sia, sentence_table=None):
+    """Enrich entities with occurrences and sentiment analysis.
+
+    Match offsets from extract_entities are mapped to sentences by bisecting
+    the sentence start offsets, so each value's sentences are looked up
+    directly rather than searched for in every sentence. Sentiment is
+    scored lazily, once per sentence that contains an entity.
+    """
+    # Split content into sentences, keeping their offsets
+    spans = split_long_spans(content, get_sentence_tokenizer().span_tokenize(content), MAX_SENTENCE_CHARS)
+    enriched = {}
+    enrich_sentences(enriched, entities, [start for start, _ in spans],
+                     [content[start:end] for start, end in spans], sia, sentence_table=sentence_table)
+    
+    # Replace original offsets with enriched information
+    entities.clear()
+    entities.update(finish_enrichment(enriched))
+    return entities
+
+def enrich_sentences(enriched, entities, sentence_starts, sentences, sia, base_index=0, previous=None,
+                     sentence_table=None):
+    """Add the occurrences of entities in sentences to enriched.
+
+    enriched maps {entity_type: {value: entity_info}} and may hold the
+    results of earlier windows of the same document; base_index is the
+    document index of sentences[0] and previous the sentence before it.
+    Occurrences hold their sentence's document index only. If given,
+    sentence_table (a SentenceTable) collects every sentence an
+    occurrence's context is made of (see artifact_context), so each
+    sentence is stored once however many entities it contains.
+    """
+    sentence_scores = [None] * len(sentences)
     
     # Process each entity type
     for entity_type, values in entities.items():
-        enriched_values = []
+        enriched_values = enriched.setdefault(entity_type, {})
         
-        for value in values:
-            entity_info = {
-                'value': value,
-                'occurrences': [],
-                'sentiment': {'positive': 0, 'negative': 0, 'neutral': 0},
-                'average_sentiment': 0
-            }
+        for value, offsets in values.items():
+            entity_info = enriched_values.get(value)
+            if entity_info is None:
+                entity_info = enriched_values[value] = {
+                    'value': value,
+                    'count': 0,
+                    'occurrences': [],
+                    'sentiment': {'positive': 0, 'negative': 0, 'neutral': 0},
+                    'average_sentiment': 0
+                }
+            entity_info['count'] += len(offsets)
             
-            # Find occurrences in sentences
-            for i, sentence in enumerate(sentences):
-                if value in sentence:
-                    # Get surrounding context (up to 3 sentences)
+            # Find the sentences containing the matches
+            sentence_indices = sorted({bisect_right(sentence_starts, offset) - 1 for offset in offsets})
+            for i in sentence_indices:
+                if i >= 0:
+                    sentence = sentences[i]
+                    # Keep the surrounding context (up to 3 sentences)
                     start_idx = max(0, i-1)
                     end_idx = min(len(sentences), i+2)
-                    context = ' '.join(sentences[start_idx:end_idx])
+                    if sentence_table is not None:
+                        for j in range(start_idx, end_idx):
+                            sentence_table[base_index + j] = sentences[j]
+                        if i == 0 and previous is not None:
+                            sentence_table[base_index - 1] = previous
                     
-                    # Calculate sentiment
-                    sentiment_scores = sia.polarity_scores(sentence)
+                    # Calculate sentiment, once per sentence
+                    sentiment_scores = sentence_scores[i]
+                    if sentiment_scores is None:
+                        sentiment_scores = sentence_scores[i] = cached_polarity_scores(sia, sentence)
                     sentiment_category = 'neutral'
                     if sentiment_scores['compound'] >= 0.05:
                         sentiment_category = 'positive'
@@ -199,27 +899,158 @@ def enrich_entities(entities, content, sia):
                     
                     # Record occurrence
                     entity_info['occurrences'].append({
-                        'context': context,
-                        'sentence_index': i,
+                        'sentence_index': base_index + i,
                         'sentiment': sentiment_scores
                     })
-            
+
+def finish_enrichment(enriched):
+    """Return {entity_type: [entity_info]} with average sentiments filled in"""
+    entities = {}
+    for entity_type, values in enriched.items():
+        for entity_info in values.values():
             # Calculate average sentiment
             if entity_info['occurrences']:
                 total_sentiment = sum(occ['sentiment']['compound'] for occ in entity_info['occurrences'])
                 entity_info['average_sentiment'] = total_sentiment / len(entity_info['occurrences'])
-            
-            enriched_values.append(entity_info)
+        if values:
+            entities[entity_type] = list(values.values())
+    return entities
+
+def analyze_stream(chunks, sia, window_chars=None, sentence_table=None):
+    """Extract and enrich entities from an iterable of byte chunks.
+
+    The text is decoded incrementally and processed in windows of about
+    window_chars characters (STREAM_WINDOW_CHARS by default). Each window is
+    cut at a sentence boundary; the last two sentences are carried into the
+    next window, so they are re-split with the text that follows and serve
+    as context. Matches are kept by the window they start in, and sentence
+    indices and counts are global, as with extract_entities and
+    enrich_entities over the whole text. Sentences are split as in
+    enrich_entities, and at most a quarter window long, which keeps the
+    carry bounded. A window with fewer than three sentences, such as blank
+    padding, is cut without a carry, so the buffer never grows past about
+    a window and a chunk.
+    """
+    window_chars = window_chars or STREAM_WINDOW_CHARS
+    max_sentence_chars = max(min(MAX_SENTENCE_CHARS, window_chars // 4), 1)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    tokenizer = get_sentence_tokenizer()
+    
+    enriched = {entity_type: {} for entity_type in PATTERNS}
+    buffer = ''
+    base_index = 0
+    previous = None
+    claimed = 0
+    windows = 0
+    chunks = iter(chunks)
+    
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += decoder.decode(b'', final=True)
+            final = True
+        else:
+            buffer += decoder.decode(chunk)
+            if len(buffer) < window_chars:
+                continue
+        
+        spans = split_long_spans(buffer, tokenizer.span_tokenize(buffer), max_sentence_chars)
+        if final:
+            processed = len(spans)
+            cut = len(buffer)
+        elif len(spans) > 2:
+            processed = len(spans) - 2
+            cut = spans[processed][0]
+        elif spans and spans[-1][1] == len(buffer):
+            # Too few sentences to carry two, so the window is mostly blank:
+            # cut it anyway, keeping only a sentence the next chunk may extend
+            processed = len(spans) - 1
+            cut = spans[-1][0]
+        else:
+            processed = len(spans)
+            cut = len(buffer)
+        
+        window_entities, claimed_end = extract_window_entities(buffer, claimed, cut)
+        sentences = [buffer[start:end] for start, end in spans]
+        enrich_sentences(enriched, window_entities, [start for start, _ in spans], sentences,
+                         sia, base_index, previous, sentence_table)
         
-        # Replace original list with enriched information
-        entities[entity_type] = enriched_values
+        if processed:
+            previous = sentences[processed - 1]
+        base_index += processed
+        if sentence_table is not None:
+            # Later windows only add sentences from base_index - 1 on
+            sentence_table.flush(base_index)
+        claimed = max(claimed_end - cut, 0)
+        buffer = buffer[cut:]
+        windows += 1
     
-    return entities
+    logger.info(f"Streamed {base_index} sentences in {windows} windows")
+    return finish_enrichment(enriched)
+
+def extract_window_entities(text, start, end):
+    """Extract entities whose match starts in text[start:end].
 
-def generate_relationships(entities):
-    """Generate relationships between different entity types"""
-    relationships = []
+    Returns the entities as extract_entities does and the offset just past
+    the last kept match, which can run into the next window.
+    """
+    entities = {}
+    claimed_end = start
+    
+    for entity_type, match, match_start, match_end in scan_entities(text):
+        if not start <= match_start < end:
+            continue
+        normalized = normalize_entity(entity_type, match)
+        if normalized:
+            entities.setdefault(entity_type, {}).setdefault(normalized, []).append(match_start)
+        claimed_end = max(claimed_end, match_end)
     
+    return entities, claimed_end
+
+def split_long_spans(text, spans, limit):
+    """Split sentence spans longer than limit at every line break, then at spaces.
+
+    Lines still longer than limit are cut at the last space before it, or
+    at limit if there is none. Blank lines are dropped.
+    """
+    result = []
+    for start, end in spans:
+        if end - start <= limit:
+            result.append((start, end))
+            continue
+        
+        position = start
+        while position < end:
+            newline = text.find('\n', position, end)
+            line_end = end if newline < 0 else newline
+            line_start = position
+            position = line_end + 1
+            while line_start < line_end and text[line_start].isspace():
+                line_start += 1
+            while line_end > line_start and text[line_end - 1].isspace():
+                line_end -= 1
+            
+            while line_end - line_start > limit:
+                cut = text.rfind(' ', line_start + 1, line_start + limit)
+                if cut < 0:
+                    cut = line_start + limit
+                result.append((line_start, cut))
+                line_start = cut
+                while line_start < line_end and text[line_start].isspace():
+                    line_start += 1
+            if line_start < line_end:
+                result.append((line_start, line_end))
+    return result
+
+def generate_relationships(entities, max_entities_per_sentence=MAX_ENTITIES_PER_SENTENCE):
+    """Generate relationships between different entity types.
+
+    Co-occurring pairs are accumulated in a dict keyed on the unordered
+    (type, value) pair, holding strength, running mean sentiment and the set
+    of sentence indices. Sentences with more than max_entities_per_sentence
+    entities only pair up a deterministic sample of them.
+    """
     # Look for co-occurrences in the same contexts
     entity_contexts = {}
     
@@ -239,7 +1070,15 @@ def generate_relationships(entities):
                 })
     
     # Then find relationships in the same contexts
+    accumulator = {}
+    sampled_sentences = 0
     for sentence_idx, context_entities in entity_contexts.items():
+        if max_entities_per_sentence and len(context_entities) > max_entities_per_sentence:
+            # Seeded by sentence index so reprocessing yields the same pairs
+            keep = random.Random(sentence_idx).sample(range(len(context_entities)), max_entities_per_sentence)
+            context_entities = [context_entities[i] for i in sorted(keep)]
+            sampled_sentences += 1
+        
         for i, entity1 in enumerate(context_entities):
             for j in range(i+1, len(context_entities)):
                 entity2 = context_entities[j]
@@ -248,56 +1087,64 @@ def generate_relationships(entities):
                 if entity1['type'] == entity2['type'] and entity1['type'] != 'email':
                     continue
                 
-                # Create relationship
-                relationship = {
-                    'source': {
-                        'type': entity1['type'],
-                        'value': entity1['value']
-                    },
-                    'target': {
-                        'type': entity2['type'],
-                        'value': entity2['value']
-                    },
-                    'context_indices': [sentence_idx],
-                    'strength': 1,  # Will be incremented for multiple co-occurrences
-                    'sentiment': (entity1['sentiment'] + entity2['sentiment']) / 2
-                }
-                
-                # Check if relationship already exists
-                existing = next((r for r in relationships if 
-                                (r['source']['type'] == relationship['source']['type'] and
-                                 r['source']['value'] == relationship['source']['value'] and
-                                 r['target']['type'] == relationship['target']['type'] and
-                                 r['target']['value'] == relationship['target']['value']) or
-                                (r['source']['type'] == relationship['target']['type'] and
-                                 r['source']['value'] == relationship['target']['value'] and
-                                 r['target']['type'] == relationship['source']['type'] and
-                                 r['target']['value'] == relationship['source']['value'])), None)
+                end1 = (entity1['type'], entity1['value'])
+                end2 = (entity2['type'], entity2['value'])
+                key = (end1, end2) if end1 <= end2 else (end2, end1)
+                pair_sentiment = (entity1['sentiment'] + entity2['sentiment']) / 2
                 
-                if existing:
-                    # Update existing relationship
-                    if sentence_idx not in existing['context_indices']:
-                        existing['context_indices'].append(sentence_idx)
-                        existing['strength'] += 1
-                        # Update average sentiment
-                        total_sentiment = existing['sentiment'] * (len(existing['context_indices']) - 1)
-                        total_sentiment += (entity1['sentiment'] + entity2['sentiment']) / 2
-                        existing['sentiment'] = total_sentiment / len(existing['context_indices'])
-                else:
-                    # Add new relationship
-                    relationships.append(relationship)
+                existing = accumulator.get(key)
+                if existing is None:
+                    # Create relationship
+                    accumulator[key] = {
+                        'source': {
+                            'type': entity1['type'],
+                            'value': entity1['value']
+                        },
+                        'target': {
+                            'type': entity2['type'],
+                            'value': entity2['value']
+                        },
+                        'context_indices': {sentence_idx},
+                        'strength': 1,  # Incremented for multiple co-occurrences
+                        'sentiment': pair_sentiment
+                    }
+                elif sentence_idx not in existing['context_indices']:
+                    # Update existing relationship and its running mean sentiment
+                    existing['context_indices'].add(sentence_idx)
+                    existing['strength'] += 1
+                    existing['sentiment'] += (pair_sentiment - existing['sentiment']) / existing['strength']
+    
+    if sampled_sentences:
+        logger.info(f"Sampled {max_entities_per_sentence} entities in {sampled_sentences} dense sentences")
+    
+    relationships = list(accumulator.values())
+    for relationship in relationships:
+        relationship['context_indices'] = sorted(relationship['context_indices'])
     
     return relationships
 
-def index_entities(entities, bucket, key, metadata):
-    """Index extracted entities to Elasticsearch"""
+def entity_doc_id(entity_type, value):
+    """Return the document ID of an entity, stable across processes"""
+    digest = hashlib.blake2b(f"{entity_type}\x00{value}".encode('utf-8'), digest_size=16).hexdigest()
+    return f"{entity_type}_{digest}"
+
+def relationship_doc_id(source, target):
+    """Return the document ID of a relationship, independent of its direction"""
+    ends = sorted([f"{source['type']}\x00{source['value']}", f"{target['type']}\x00{target['value']}"])
+    digest = hashlib.blake2b('\x01'.join(ends).encode('utf-8'), digest_size=16).hexdigest()
+    return f"rel_{digest}"
+
+def index_entities(entities, bucket, key, metadata, sentence_table):
+    """Upsert extracted entities into Elasticsearch.
+
+    There is one document per entity, whose totals each source document
+    adds to (see ENTITY_MERGE_SCRIPT). Reprocessing one of the last
+    ES_MAX_SOURCES sources replaces its contribution instead of adding it
+    twice. The contexts of the occurrences sent along are rebuilt from
+    sentence_table (see enrich_sentences).
+    """
     timestamp = datetime.utcnow().isoformat()
-    
-    # Prepare the ES auth
-    auth = HTTPBasicAuth(ES_USERNAME, ES_PASSWORD)
-    
-    # Create ES indices if they don't exist
-    create_indices(auth)
+    source_id = f"{bucket}/{key}"
     
     # Prepare document metadata
     doc_metadata = {
@@ -310,105 +1157,302 @@ def index_entities(entities, bucket, key, metadata):
         'processed_at': timestamp
     }
     
-    # Index each entity
-    for entity_type, values in entities.items():
-        for entity_info in values:
-            # Prepare document ID based on entity type and value
-            doc_id = f"{entity_type}_{hash(entity_info['value'])}"
-            
-            # Prepare entity document
-            doc = {
-                'entity_type': entity_type,
-                'value': entity_info['value'],
-                'processed_at': timestamp,
-                'metadata': doc_metadata,
-                'occurrences': entity_info['occurrences'],
-                'sentiment': entity_info['sentiment'],
-                'average_sentiment': entity_info['average_sentiment']
-            }
-            
-            # Index to Elasticsearch
-            try:
-                url = f"{ES_ENDPOINT}/entities/_doc/{doc_id}"
-                response = requests.put(
-                    url,
-                    json=doc,
-                    auth=auth,
-                    headers={"Content-Type": "application/json"}
+    # Upsert each entity
+    def actions():
+        for entity_type, values in entities.items():
+            for entity_info in values:
+                occurrences = entity_info['occurrences']
+                params = {
+                    'source_id': source_id,
+                    'stats': {
+                        **entity_info['sentiment'],
+                        'occurrences': len(occurrences),
+                        'mentions': entity_info.get('count', len(occurrences)),
+                        'sentiment_sum': entity_info['average_sentiment'] * len(occurrences)
+                    },
+                    'occurrences': [
+                        dict(occurrence, source_id=source_id,
+                             context=artifact_context(sentence_table, occurrence['sentence_index']))
+                        for occurrence in occurrences[-ES_MAX_OCCURRENCES:]
+                    ],
+                    'max_occurrences': ES_MAX_OCCURRENCES,
+                    'max_sources': ES_MAX_SOURCES,
+                    'metadata': doc_metadata,
+                    'processed_at': timestamp
+                }
+                yield (
+                    {'update': {'_index': 'entities', '_id': entity_doc_id(entity_type, entity_info['value']),
+                                'retry_on_conflict': 3}},
+                    {
+                        'scripted_upsert': True,
+                        'script': {'id': ENTITY_MERGE_SCRIPT_ID, 'params': params},
+                        'upsert': {'entity_type': entity_type, 'value': entity_info['value'], 'first_seen': timestamp}
+                    }
                 )
-                response.raise_for_status()
-                logger.info(f"Indexed entity: {entity_type}/{entity_info['value']}")
-                
-            except Exception as e:
-                logger.error(f"Error indexing entity to Elasticsearch: {str(e)}")
+    
+    stats = bulk_write(actions())
+    logger.info(f"Indexed {stats['indexed']} entities for {bucket}/{key}")
+    return stats
 
 def index_relationships(relationships, bucket, key):
-    """Index entity relationships to Elasticsearch"""
+    """Upsert entity relationships into Elasticsearch, one document per entity pair"""
     timestamp = datetime.utcnow().isoformat()
+    source_id = f"{bucket}/{key}"
     
-    # Prepare the ES auth
-    auth = HTTPBasicAuth(ES_USERNAME, ES_PASSWORD)
-    
-    # Index each relationship
-    for relationship in relationships:
-        # Generate a unique ID for the relationship
-        source_hash = hash(f"{relationship['source']['type']}_{relationship['source']['value']}")
-        target_hash = hash(f"{relationship['target']['type']}_{relationship['target']['value']}")
-        rel_id = f"rel_{min(source_hash, target_hash)}_{max(source_hash, target_hash)}"
-        
-        # Prepare relationship document
-        doc = {
-            'source': relationship['source'],
-            'target': relationship['target'],
-            'context_indices': relationship['context_indices'],
-            'strength': relationship['strength'],
-            'sentiment': relationship['sentiment'],
-            'processed_at': timestamp,
-            'source_document': {
-                'bucket': bucket,
-                'key': key
+    # Upsert each relationship
+    def actions():
+        for relationship in relationships:
+            doc_id = relationship_doc_id(relationship['source'], relationship['target'])
+            params = {
+                'source_id': source_id,
+                'pair_id': doc_id,
+                'stats': {
+                    'strength': relationship['strength'],
+                    'sentiment_sum': relationship['sentiment'] * relationship['strength']
+                },
+                'max_sources': ES_MAX_SOURCES,
+                'context_indices': relationship['context_indices'],
+                'source_document': {
+                    'bucket': bucket,
+                    'key': key
+                },
+                'processed_at': timestamp
             }
-        }
+            yield (
+                {'update': {'_index': 'relationships',
+                            '_id': doc_id,
+                            'retry_on_conflict': 3}},
+                {
+                    'scripted_upsert': True,
+                    'script': {'id': RELATIONSHIP_MERGE_SCRIPT_ID, 'params': params},
+                    'upsert': {
+                        'source': relationship['source'],
+                        'target': relationship['target'],
+                        'first_seen': timestamp
+                    }
+                }
+            )
+    
+    stats = bulk_write(actions())
+    logger.info(f"Indexed {stats['indexed']} relationships for {bucket}/{key}")
+    return stats
+
+def get_s3_client():
+    """Return the S3 client shared by the invocations of this container"""
+    global _s3_client
+    if _s3_client is None:
+        with startup_phase('s3_client'):
+            _s3_client = boto3.client('s3')
+    return _s3_client
+
+def get_http_session():
+    """Return the pooled, authenticated HTTP session used for Elasticsearch"""
+    global _http_session
+    if _http_session is None:
+        with startup_phase('http_session'):
+            session = requests.Session()
+            session.auth = HTTPBasicAuth(ES_USERNAME, ES_PASSWORD)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=ES_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+    return _http_session
+
+def bulk_write(actions, batch_size=None, endpoint=None, session=None, max_bytes=None):
+    """Stream (action, source) pairs to Elasticsearch through _bulk requests.
+
+    action is a bulk action line such as {'index': {'_index': ..., '_id': ...}}.
+    Requests hold at most batch_size actions (ES_BULK_SIZE by default) and
+    max_bytes of body (ES_BULK_MAX_BYTES); a single larger action is sent
+    alone. A request rejected with 413 as too large is split in half and
+    resent. Network errors, and requests or items rejected with a retryable
+    status, are resent with exponential backoff; RuntimeError is raised when
+    the retries run out. A request rejected with any other status (400,
+    401, ...) raises requests.HTTPError. Items rejected permanently are
+    logged and counted as failed, so callers must check stats['failed'].
+    Returns throughput statistics.
+    """
+    batch_size = batch_size or ES_BULK_SIZE
+    max_bytes = max_bytes or ES_BULK_MAX_BYTES
+    endpoint = endpoint or ES_ENDPOINT
+    session = session or get_http_session()
+    stats = {'indexed': 0, 'failed': 0, 'retried': 0, 'requests': 0, 'bytes': 0}
+    started = time.monotonic()
+    
+    # Each action is serialized once; retries resend the same lines
+    batch = []
+    batch_bytes = 0
+    for action, source in actions:
+        line = (json.dumps(action) + '\n' + json.dumps(source, default=str) + '\n').encode('utf-8')
+        if batch and batch_bytes + len(line) > max_bytes:
+            _send_bulk(batch, stats, endpoint, session)
+            batch = []
+            batch_bytes = 0
+        batch.append(line)
+        batch_bytes += len(line)
+        if len(batch) >= batch_size:
+            _send_bulk(batch, stats, endpoint, session)
+            batch = []
+            batch_bytes = 0
+    if batch:
+        _send_bulk(batch, stats, endpoint, session)
+    
+    elapsed = time.monotonic() - started
+    stats['seconds'] = round(elapsed, 3)
+    stats['docs_per_sec'] = round(stats['indexed'] / elapsed, 1) if elapsed > 0 else 0.0
+    if stats['requests']:
+        logger.info(f"Elasticsearch bulk: {json.dumps(stats)}")
+    return stats
+
+def _send_bulk(batch, stats, endpoint, session):
+    """Send one _bulk request of serialized actions, retrying only the items that failed transiently"""
+    pending = batch
+    
+    for attempt in range(ES_BULK_MAX_RETRIES + 1):
+        if attempt:
+            stats['retried'] += len(pending)
+            time.sleep(min(ES_BULK_BACKOFF * 2 ** (attempt - 1), 30))
         
-        # Index to Elasticsearch
+        body = b''.join(pending)
         try:
-            url = f"{ES_ENDPOINT}/relationships/_doc/{rel_id}"
-            response = requests.put(
-                url,
-                json=doc,
-                auth=auth,
-                headers={"Content-Type": "application/json"}
+            response = session.post(
+                f"{endpoint}/_bulk",
+                data=body,
+                headers={"Content-Type": "application/x-ndjson"},
+                timeout=ES_TIMEOUT
             )
-            response.raise_for_status()
-            logger.info(f"Indexed relationship: {relationship['source']['value']} - {relationship['target']['value']}")
-            
-        except Exception as e:
-            logger.error(f"Error indexing relationship to Elasticsearch: {str(e)}")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logger.warning(f"Elasticsearch bulk request failed: {str(e)}")
+            continue
+        stats['requests'] += 1
+        stats['bytes'] += len(body)
+        if response.status_code == 413 and len(pending) > 1:
+            # Larger than http.max_content_length: send each half on its own
+            logger.warning(f"Elasticsearch bulk request of {len(body)} bytes too large, splitting {len(pending)} items")
+            half = len(pending) // 2
+            _send_bulk(pending[:half], stats, endpoint, session)
+            _send_bulk(pending[half:], stats, endpoint, session)
+            return
+        if response.status_code in RETRYABLE_STATUSES:
+            logger.warning(f"Elasticsearch bulk request rejected with {response.status_code}")
+            continue
+        # Any other rejection of the whole request is permanent
+        response.raise_for_status()
+        result = response.json()
+        
+        retry = []
+        rejected = 0
+        if result.get('errors'):
+            for line, item in zip(pending, result['items']):
+                outcome = next(iter(item.values()))
+                status = outcome.get('status', 500)
+                if status < 300:
+                    continue
+                if status in RETRYABLE_STATUSES:
+                    retry.append(line)
+                else:
+                    rejected += 1
+                    logger.error(f"Error indexing {outcome.get('_index')}/{outcome.get('_id')}: {outcome.get('error')}")
+        
+        stats['indexed'] += len(pending) - len(retry) - rejected
+        stats['failed'] += rejected
+        if not retry:
+            return
+        pending = retry
+    
+    stats['failed'] += len(pending)
+    raise RuntimeError(f"Gave up on {len(pending)} Elasticsearch bulk items after {ES_BULK_MAX_RETRIES} retries")
 
-def create_indices(auth):
-    """Create Elasticsearch indices if they don't exist"""
-    indices = ['entities', 'relationships']
+def bootstrap_indices():
+    """Install index templates, create or update the entity indices and store the merge scripts.
+
+    Run once per deployment by invoking the function with
+    {"action": "bootstrap_indices"}; document processing only validates.
+    """
+    session = get_http_session()
+    results = {}
     
-    for index in indices:
-        try:
-            # Check if index exists
-            url = f"{ES_ENDPOINT}/{index}"
-            response = requests.head(url, auth=auth)
-            
-            if response.status_code == 404:
-                # Create index
-                mapping = get_index_mapping(index)
-                create_response = requests.put(
-                    url,
-                    json=mapping,
-                    auth=auth,
-                    headers={"Content-Type": "application/json"}
-                )
-                create_response.raise_for_status()
-                logger.info(f"Created Elasticsearch index: {index}")
+    for index in ES_INDICES:
+        mapping = get_index_mapping(index)
+        
+        # Template so indices recreated by _bulk writes get the same mapping
+        response = session.put(
+            f"{ES_ENDPOINT}/_index_template/detector-gadget-{index}",
+            json={'index_patterns': [index], 'priority': 100, 'template': mapping},
+            timeout=ES_TIMEOUT
+        )
+        response.raise_for_status()
         
-        except Exception as e:
-            logger.error(f"Error creating Elasticsearch index {index}: {str(e)}")
+        url = f"{ES_ENDPOINT}/{index}"
+        if session.head(url, timeout=ES_TIMEOUT).status_code == 404:
+            response = session.put(url, json=mapping, timeout=ES_TIMEOUT)
+            results[index] = 'created'
+        else:
+            # Mapping updates only add fields, existing ones must not conflict
+            response = session.put(f"{url}/_mapping", json=mapping['mappings'], timeout=ES_TIMEOUT)
+            results[index] = 'updated'
+        response.raise_for_status()
+        logger.info(f"Bootstrapped Elasticsearch index {index}: {results[index]}")
+    
+    for script_id, source in ES_STORED_SCRIPTS.items():
+        response = session.put(
+            f"{ES_ENDPOINT}/_scripts/{script_id}",
+            json={'script': {'lang': 'painless', 'source': source}},
+            timeout=ES_TIMEOUT
+        )
+        response.raise_for_status()
+        results[script_id] = 'stored'
+        logger.info(f"Stored Elasticsearch script {script_id}")
+    
+    global _indices_ready
+    _indices_ready = True
+    return results
+
+def missing_index_setup():
+    """Return the indices whose mapping or template lacks expected fields, and the scripts not stored"""
+    session = get_http_session()
+    response = session.get(
+        f"{ES_ENDPOINT}/{','.join(ES_INDICES)}/_mapping",
+        params={'ignore_unavailable': 'true', 'allow_no_indices': 'true'},
+        timeout=ES_TIMEOUT
+    )
+    response.raise_for_status()
+    mapped = response.json()
+    
+    missing = []
+    for index in ES_INDICES:
+        expected = get_index_mapping(index)['mappings']['properties']
+        if index in mapped:
+            properties = mapped[index].get('mappings', {}).get('properties', {})
+            if not set(expected) <= set(properties):
+                missing.append(index)
+        else:
+            # Not created yet; the first _bulk write creates it from the template
+            template = session.head(f"{ES_ENDPOINT}/_index_template/detector-gadget-{index}", timeout=ES_TIMEOUT)
+            if template.status_code != 200:
+                missing.append(index)
+    for script_id in ES_STORED_SCRIPTS:
+        if session.get(f"{ES_ENDPOINT}/_scripts/{script_id}", timeout=ES_TIMEOUT).status_code != 200:
+            missing.append(script_id)
+    return missing
+
+def ensure_indices():
+    """Validate the index setup once per container"""
+    global _indices_ready
+    if _indices_ready:
+        return
+    
+    with startup_phase('index_check'):
+        missing = missing_index_setup()
+    if missing:
+        if not ES_AUTO_BOOTSTRAP:
+            raise RuntimeError(
+                f"Elasticsearch indices or scripts not bootstrapped: {', '.join(missing)}; "
+                'invoke the function with {"action": "bootstrap_indices"}'
+            )
+        logger.warning(f"Bootstrapping Elasticsearch indices from the processing path: {', '.join(missing)}")
+        bootstrap_indices()
+    _indices_ready = True
 
 def get_index_mapping(index):
     """Get index mapping based on index type"""
@@ -419,6 +1463,7 @@ def get_index_mapping(index):
                     "entity_type": {"type": "keyword"},
                     "value": {"type": "keyword"},
                     "processed_at": {"type": "date"},
+                    "first_seen": {"type": "date"},
                     "metadata": {
                         "properties": {
                             "source_bucket": {"type": "keyword"},
@@ -434,6 +1479,7 @@ def get_index_mapping(index):
                         "properties": {
                             "context": {"type": "text"},
                             "sentence_index": {"type": "integer"},
+                            "source_id": {"type": "keyword"},
                             "sentiment": {
                                 "properties": {
                                     "compound": {"type": "float"},
@@ -451,7 +1497,12 @@ def get_index_mapping(index):
                             "neutral": {"type": "integer"}
                         }
                     },
-                    "average_sentiment": {"type": "float"}
+                    "average_sentiment": {"type": "float"},
+                    "occurrence_count": {"type": "integer"},
+                    "mention_count": {"type": "integer"},
+                    "document_count": {"type": "integer"},
+                    "sentiment_sum": {"type": "double"},
+                    "recent_sources": {"type": "object", "enabled": False}
                 }
             }
         }
@@ -471,10 +1522,15 @@ def get_index_mapping(index):
                             "value": {"type": "keyword"}
                         }
                     },
+                    "pair_id": {"type": "keyword"},
                     "context_indices": {"type": "integer"},
                     "strength": {"type": "integer"},
                     "sentiment": {"type": "float"},
                     "processed_at": {"type": "date"},
+                    "first_seen": {"type": "date"},
+                    "document_count": {"type": "integer"},
+                    "sentiment_sum": {"type": "double"},
+                    "recent_sources": {"type": "object", "enabled": False},
                     "source_document": {
                         "properties": {
                             "bucket": {"type": "keyword"},
@@ -485,38 +1541,198 @@ def get_index_mapping(index):
             }
         }
     
+    elif index == 'processed_content':
+        return {
+            "mappings": {
+                "properties": {
+                    "content_id": {"type": "keyword"},
+                    "artifact_key": {"type": "keyword"},
+                    "sources": {
+                        "properties": {
+                            "bucket": {"type": "keyword"},
+                            "key": {"type": "keyword"}
+                        }
+                    },
+                    "processed_at": {"type": "date"}
+                }
+            }
+        }
+    
     return {}
 
-def store_analysis_results(entities, relationships, bucket, key):
-    """Store analysis results as a JSON artifact in S3"""
-    analysis_results = {
+def store_analysis_results(entities, relationships, bucket, key, content_id, sentence_table=None):
+    """Store analysis results as an artifact in S3, returning its key.
+
+    Artifacts are named by content id, so identical content maps to one
+    artifact; None is returned if it could not be stored. The compact
+    format (see write_compact_artifact) is used unless ARTIFACT_FORMAT is
+    'json', which writes the nested results as one JSON document.
+    """
+    processed_at = datetime.utcnow().isoformat()
+    summary = {
         'source': {
             'bucket': bucket,
             'key': key
         },
-        'processed_at': datetime.utcnow().isoformat(),
-        'entities': entities,
-        'relationships': relationships,
-        'summary': {
-            'entity_counts': {entity_type: len(values) for entity_type, values in entities.items()},
-            'relationship_count': len(relationships)
-        }
+        'content_id': content_id,
+        'processed_at': processed_at,
+        'entity_counts': {entity_type: len(values) for entity_type, values in entities.items()},
+        'relationship_count': len(relationships)
     }
     
     # Create artifact key
-    source_key_parts = key.split('/')
-    filename = source_key_parts[-1]
-    artifact_key = f"analysis/{filename}_analysis_{uuid.uuid4()}.json"
+    artifact_name = f"analysis/{content_id.replace(':', '/')}"
+    if sentence_table is None:
+        sentence_table = SentenceTable()
+    if ARTIFACT_FORMAT == 'json':
+        artifact_key = f"{artifact_name}.json"
+        body = json.dumps({
+            'source': summary['source'],
+            'content_id': content_id,
+            'processed_at': processed_at,
+            'entities': {
+                entity_type: [
+                    dict(info, occurrences=[
+                        dict(occurrence, context=artifact_context(sentence_table, occurrence['sentence_index']))
+                        for occurrence in info['occurrences']
+                    ])
+                    for info in values
+                ]
+                for entity_type, values in entities.items()
+            },
+            'relationships': relationships,
+            'summary': {
+                'entity_counts': summary['entity_counts'],
+                'relationship_count': summary['relationship_count']
+            }
+        }, indent=2)
+        extra_args = {'ContentType': 'application/json'}
+    else:
+        artifact_key = f"{artifact_name}.jsonl.gz"
+        # Written to a temporary file, so the sentences are never all in memory
+        body = tempfile.TemporaryFile()
+        write_compact_artifact(summary, entities, relationships, sentence_table, body)
+        body.seek(0)
+        extra_args = {'ContentType': 'application/x-ndjson', 'ContentEncoding': 'gzip'}
     
     # Store artifact in S3
     try:
-        s3.put_object(
+        get_s3_client().put_object(
             Bucket=ARTIFACTS_BUCKET,
             Key=artifact_key,
-            Body=json.dumps(analysis_results, indent=2),
-            ContentType='application/json'
+            Body=body,
+            **extra_args
         )
         logger.info(f"Stored analysis results to {ARTIFACTS_BUCKET}/{artifact_key}")
+        return artifact_key
     
     except Exception as e:
         logger.error(f"Error storing analysis results: {str(e)}")
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+def write_compact_artifact(summary, entities, relationships, sentence_table, out):
+    """Write the gzipped JSON-lines artifact of one analysis to the binary file out.
+
+    Each section is a header line {"section": name, "rows": n} followed by
+    one line of columns (name -> list of values), in the order of
+    ARTIFACT_SECTIONS with the summary first. Occurrences reference their
+    entity by row and their sentence by document index; the text of every
+    context sentence is stored once in the sentences section, which is
+    streamed from sentence_table (a SentenceTable) a sentence at a time.
+    """
+    entity_rows = [(entity_type, entity_info) for entity_type, values in entities.items() for entity_info in values]
+    
+    sections = {
+        'summary': dict(summary, format_version=COMPACT_ARTIFACT_VERSION),
+        'entities': {
+            'type': [entity_type for entity_type, _ in entity_rows],
+            'value': [info['value'] for _, info in entity_rows],
+            'count': [info.get('count', len(info['occurrences'])) for _, info in entity_rows],
+            'positive': [info['sentiment']['positive'] for _, info in entity_rows],
+            'negative': [info['sentiment']['negative'] for _, info in entity_rows],
+            'neutral': [info['sentiment']['neutral'] for _, info in entity_rows],
+            'average_sentiment': [info['average_sentiment'] for _, info in entity_rows]
+        },
+        'occurrences': {'entity': [], 'sentence_index': [], 'compound': [], 'pos': [], 'neg': [], 'neu': []},
+        'relationships': {
+            'source_type': [rel['source']['type'] for rel in relationships],
+            'source_value': [rel['source']['value'] for rel in relationships],
+            'target_type': [rel['target']['type'] for rel in relationships],
+            'target_value': [rel['target']['value'] for rel in relationships],
+            'strength': [rel['strength'] for rel in relationships],
+            'sentiment': [rel['sentiment'] for rel in relationships],
+            'context_indices': [rel['context_indices'] for rel in relationships]
+        }
+    }
+    occurrences = sections['occurrences']
+    for row, (_, info) in enumerate(entity_rows):
+        for occurrence in info['occurrences']:
+            occurrences['entity'].append(row)
+            occurrences['sentence_index'].append(occurrence['sentence_index'])
+            for name in ('compound', 'pos', 'neg', 'neu'):
+                occurrences[name].append(occurrence['sentiment'][name])
+    
+    with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as lines:
+        for name in ARTIFACT_SECTIONS:
+            if name == 'sentences':
+                write_sentence_section(sentence_table, lines)
+                continue
+            columns = sections[name]
+            rows = 1 if name == 'summary' else len(next(iter(columns.values()), []))
+            lines.write(json.dumps({'section': name, 'rows': rows}).encode('utf-8') + b'\n')
+            lines.write(json.dumps(columns, separators=(',', ':')).encode('utf-8') + b'\n')
+
+def write_sentence_section(sentence_table, lines):
+    """Write the sentences section as write_compact_artifact lays it out, one sentence at a time"""
+    lines.write(json.dumps({'section': 'sentences', 'rows': len(sentence_table)}).encode('utf-8') + b'\n')
+    lines.write(b'{"index":')
+    write_json_array(sentence_table.indices(), lines)
+    lines.write(b',"text":')
+    write_json_array((text for _, text in sentence_table.items()), lines)
+    lines.write(b'}\n')
+
+def write_json_array(values, out):
+    """Write an iterable as a JSON array to the binary file out without building a list"""
+    out.write(b'[')
+    separator = b''
+    for value in values:
+        out.write(separator + json.dumps(value).encode('utf-8'))
+        separator = b','
+    out.write(b']')
+
+def read_analysis_artifact(bucket, key, sections=('summary',)):
+    """Load the given sections of a compact analysis artifact from S3.
+
+    Returns {section: columns}. Other sections are skipped without being
+    parsed, and reading stops once all requested sections were seen.
+    """
+    wanted = set(sections)
+    result = {}
+    response = get_s3_client().get_object(Bucket=bucket, Key=key)
+    with gzip.GzipFile(fileobj=response['Body'], mode='rb') as lines:
+        for header in lines:
+            name = json.loads(header)['section']
+            data = lines.readline()
+            if name in wanted:
+                result[name] = json.loads(data)
+                if len(result) == len(wanted):
+                    break
+    response['Body'].close()
+    return result
+
+def artifact_rows(columns):
+    """Yield the rows of an artifact section as dicts"""
+    names = list(columns)
+    for values in zip(*(columns[name] for name in names)):
+        yield dict(zip(names, values))
+
+def artifact_context(sentence_text, sentence_index):
+    """Rebuild the context of an occurrence.
+
+    sentence_text maps document index to sentence, as built by
+    dict(zip(sentences['index'], sentences['text'])) from the sentences
+    section.
+    """
+    return ' '.join(sentence_text[i] for i in range(sentence_index - 1, sentence_index + 2) if i in sentence_text)
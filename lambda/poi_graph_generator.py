@@ -1,11 +1,19 @@
 import os
 import json
+import math
+import random
 import boto3
 import logging
 import requests
-import uuid
+import multiprocessing
+from array import array
+from collections import deque
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
 import networkx as nx
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 import matplotlib.pyplot as plt
 import matplotlib
@@ -16,14 +24,53 @@ from io import BytesIO
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize clients
-s3 = boto3.client('s3')
+# Get environment variables. They are set on the function; importing this
+# module without them (tests) has no side effects
+ES_ENDPOINT = os.environ.get('ELASTICSEARCH_ENDPOINT', '')
+ES_USERNAME = os.environ.get('ELASTICSEARCH_USERNAME', '')
+ES_PASSWORD = os.environ.get('ELASTICSEARCH_PASSWORD', '')
+REPORTS_BUCKET = os.environ.get('REPORTS_BUCKET', '')
 
-# Get environment variables
-ES_ENDPOINT = os.environ['ELASTICSEARCH_ENDPOINT']
-ES_USERNAME = os.environ['ELASTICSEARCH_USERNAME']
-ES_PASSWORD = os.environ['ELASTICSEARCH_PASSWORD']
-REPORTS_BUCKET = os.environ['REPORTS_BUCKET']
+# Relationships are read in pages of ES_PAGE_SIZE through a point in time
+# kept alive for ES_PIT_KEEP_ALIVE between pages
+ES_PAGE_SIZE = int(os.environ.get('ES_PAGE_SIZE', '5000'))
+ES_PIT_KEEP_ALIVE = os.environ.get('ES_PIT_KEEP_ALIVE', '2m')
+ES_TIMEOUT = int(os.environ.get('ES_TIMEOUT', '60'))
+
+# How relationships are loaded: 'aggregate' fetches one row per entity pair
+# from a composite aggregation, 'search' every relationship document
+GRAPH_LOADER = os.environ.get('GRAPH_LOADER', 'aggregate')
+ES_AGG_PAGE_SIZE = int(os.environ.get('ES_AGG_PAGE_SIZE', '1000'))
+
+# Betweenness centrality: BETWEENNESS_MODE 'exact', 'sampled', or 'auto'
+# (exact up to BETWEENNESS_EXACT_MAX_NODES nodes). Sampled betweenness uses
+# about BETWEENNESS_SAMPLES seeded source nodes, spread over the connected
+# components by size. BETWEENNESS_WORKERS > 1 splits the sources across
+# processes.
+BETWEENNESS_MODE = os.environ.get('BETWEENNESS_MODE', 'auto')
+BETWEENNESS_EXACT_MAX_NODES = int(os.environ.get('BETWEENNESS_EXACT_MAX_NODES', '2000'))
+BETWEENNESS_SAMPLES = int(os.environ.get('BETWEENNESS_SAMPLES', '500'))
+BETWEENNESS_SEED = int(os.environ.get('BETWEENNESS_SEED', '42'))
+BETWEENNESS_WORKERS = int(os.environ.get('BETWEENNESS_WORKERS', '1'))
+BETWEENNESS_CONFIDENCE = 0.95
+
+# Larger graphs get eigenvector centrality from a sparse-matrix power
+# iteration instead of the NetworkX dict-based one
+EIGENVECTOR_EXACT_MAX_NODES = int(os.environ.get('EIGENVECTOR_EXACT_MAX_NODES', '5000'))
+
+# Graph representation: 'networkx', or 'csr' for entity values interned to
+# integer IDs with the edges held in SciPy CSR matrices. The csr backend
+# converts to NetworkX only for graphs it draws, up to DRAW_MAX_NODES nodes.
+GRAPH_BACKEND = os.environ.get('GRAPH_BACKEND', 'networkx')
+DRAW_MAX_NODES = int(os.environ.get('DRAW_MAX_NODES', '2000'))
+
+# Relationship fields build_graph reads
+RELATIONSHIP_FIELDS = ['source.type', 'source.value', 'target.type', 'target.value', 'strength', 'sentiment']
+
+# HTTP session shared by all Elasticsearch requests of a warm container
+_http_session = None
+# S3 client of a warm container, created on first use
+_s3_client = None
 
 # Entity type colors for visualization
 ENTITY_COLORS = {
@@ -42,21 +89,21 @@ def handler(event, context):
     logger.info("Starting POI graph generation")
     
     try:
-        # Query relationships from Elasticsearch
-        relationships = query_relationships()
+        # Build graph from relationships, streamed from Elasticsearch
+        if GRAPH_BACKEND == 'csr':
+            graph = build_csr_graph(load_relationships())
+        else:
+            graph = build_graph(load_relationships())
         
-        if not relationships:
+        if graph.number_of_edges() == 0:
             logger.info("No relationships found to generate graphs")
             return {
                 'statusCode': 200,
                 'body': json.dumps('No relationships found')
             }
         
-        # Build graph from relationships
-        graph = build_graph(relationships)
-        
         # Generate various graph analyses
-        generate_graph_analyses(graph, relationships)
+        generate_graph_analyses(graph)
         
         return {
             'statusCode': 200,
@@ -67,63 +114,236 @@ def handler(event, context):
         logger.error(f"Error generating POI graphs: {str(e)}")
         raise
 
-def query_relationships(days=30, min_strength=1):
-    """Query entity relationships from Elasticsearch"""
-    auth = HTTPBasicAuth(ES_USERNAME, ES_PASSWORD)
-    
+def get_s3_client():
+    """Return the S3 client reports are stored with"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3')
+    return _s3_client
+
+def get_http_session():
+    """Return the authenticated HTTP session used for Elasticsearch"""
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        session.auth = HTTPBasicAuth(ES_USERNAME, ES_PASSWORD)
+        session.mount('https://', HTTPAdapter(max_retries=3))
+        session.mount('http://', HTTPAdapter(max_retries=3))
+        _http_session = session
+    return _http_session
+
+def relationships_query(days=30, min_strength=1):
+    """Return the query selecting recent relationships of at least min_strength"""
     # Calculate date range
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    # Build query
-    query = {
-        "size": 10000,  # Adjust based on expected volume
-        "query": {
-            "bool": {
-                "must": [
-                    {
-                        "range": {
-                            "processed_at": {
-                                "gte": start_date.isoformat(),
-                                "lte": end_date.isoformat()
-                            }
+    return {
+        "bool": {
+            "filter": [
+                {
+                    "range": {
+                        "processed_at": {
+                            "gte": start_date.isoformat(),
+                            "lte": end_date.isoformat()
                         }
-                    },
-                    {
-                        "range": {
-                            "strength": {
-                                "gte": min_strength
-                            }
+                    }
+                },
+                {
+                    "range": {
+                        "strength": {
+                            "gte": min_strength
                         }
                     }
-                ]
-            }
+                }
+            ]
         }
     }
+
+def iter_relationships(days=30, min_strength=1, page_size=None, endpoint=None, session=None):
+    """Yield relationships from Elasticsearch page by page.
+
+    Pages of page_size hits (ES_PAGE_SIZE by default) are read with
+    search_after within a point in time, ordered by _shard_doc, so the
+    whole index is covered consistently and only one page is held at a
+    time. Clusters without the point in time API are paged with
+    search_after alone, ordered by the pair_id keyword; relationships
+    indexed before pair_id was stored lack it and are skipped. Only the
+    fields in RELATIONSHIP_FIELDS are returned.
+    """
+    page_size = page_size or ES_PAGE_SIZE
+    endpoint = endpoint or ES_ENDPOINT
+    session = session or get_http_session()
+    
+    query = relationships_query(days, min_strength)
+    body = {
+        "size": page_size,
+        "query": query,
+        "_source": RELATIONSHIP_FIELDS,
+        "track_total_hits": False
+    }
     
+    pit_id = open_point_in_time(session, endpoint)
+    # Sorting on _id needs fielddata; page on the point in time's own
+    # tiebreaker, or on pair_id, a keyword with doc values
+    if pit_id:
+        body["sort"] = [{"_shard_doc": "asc"}]
+    else:
+        # Documents without pair_id would all tie on the sort value, so
+        # search_after could skip any of them
+        legacy = count_relationships(session, endpoint, {
+            "bool": {"filter": [query], "must_not": [{"exists": {"field": "pair_id"}}]}
+        })
+        if legacy:
+            logger.warning(f"Skipping {legacy} relationships indexed without pair_id; "
+                           "they are included again once updated or reindexed")
+        body["query"] = {"bool": {"filter": [query, {"exists": {"field": "pair_id"}}]}}
+        body["sort"] = [{"pair_id": {"order": "asc", "unmapped_type": "keyword"}}]
+    url = f"{endpoint}/_search" if pit_id else f"{endpoint}/relationships/_search"
+    count = 0
+    pages = 0
     try:
-        # Query Elasticsearch
-        url = f"{ES_ENDPOINT}/relationships/_search"
-        response = requests.post(
-            url,
-            json=query,
-            auth=auth,
-            headers={"Content-Type": "application/json"}
-        )
+        while True:
+            if pit_id:
+                body["pit"] = {"id": pit_id, "keep_alive": ES_PIT_KEEP_ALIVE}
+            response = session.post(url, json=body, timeout=ES_TIMEOUT)
+            response.raise_for_status()
+            results = response.json()
+            pit_id = results.get('pit_id', pit_id)
+            
+            hits = results.get('hits', {}).get('hits', [])
+            pages += 1
+            for hit in hits:
+                yield hit['_source']
+            count += len(hits)
+            
+            if len(hits) < page_size:
+                break
+            body["search_after"] = hits[-1]['sort']
+    finally:
+        if pit_id:
+            close_point_in_time(session, endpoint, pit_id)
+    
+    logger.info(f"Retrieved {count} relationships from Elasticsearch in {pages} pages")
+
+def count_relationships(session, endpoint, query):
+    """Return the number of relationship documents matching query"""
+    response = session.post(f"{endpoint}/relationships/_count", json={"query": query}, timeout=ES_TIMEOUT)
+    response.raise_for_status()
+    return response.json()['count']
+
+def load_relationships(days=30, min_strength=1):
+    """Return an iterator over relationships from the GRAPH_LOADER source"""
+    if GRAPH_LOADER == 'search':
+        return iter_relationships(days, min_strength)
+    return iter_aggregated_relationships(days, min_strength)
+
+def iter_aggregated_relationships(days=30, min_strength=1, page_size=None, endpoint=None, session=None):
+    """Yield one relationship per entity pair, aggregated in Elasticsearch.
+
+    A composite aggregation over the source and target type and value
+    returns the summed strength and the strength-weighted mean sentiment
+    of all matching documents of each pair, page by page.
+    """
+    page_size = page_size or ES_AGG_PAGE_SIZE
+    endpoint = endpoint or ES_ENDPOINT
+    session = session or get_http_session()
+    
+    composite = {
+        "size": page_size,
+        "sources": [
+            {"source_type": {"terms": {"field": "source.type"}}},
+            {"source_value": {"terms": {"field": "source.value"}}},
+            {"target_type": {"terms": {"field": "target.type"}}},
+            {"target_value": {"terms": {"field": "target.value"}}}
+        ]
+    }
+    body = {
+        "size": 0,
+        "query": relationships_query(days, min_strength),
+        "track_total_hits": False,
+        "aggs": {
+            "pairs": {
+                "composite": composite,
+                "aggs": {
+                    "strength": {"sum": {"field": "strength"}},
+                    "sentiment": {
+                        "weighted_avg": {
+                            "value": {"field": "sentiment"},
+                            "weight": {"field": "strength"}
+                        }
+                    }
+                }
+            }
+        }
+    }
+    
+    count = 0
+    pages = 0
+    while True:
+        response = session.post(f"{endpoint}/relationships/_search", json=body, timeout=ES_TIMEOUT)
         response.raise_for_status()
+        pairs = response.json()['aggregations']['pairs']
+        pages += 1
         
-        results = response.json()
-        relationships = [hit['_source'] for hit in results.get('hits', {}).get('hits', [])]
+        for bucket in pairs['buckets']:
+            key = bucket['key']
+            yield {
+                'source': {'type': key['source_type'], 'value': key['source_value']},
+                'target': {'type': key['target_type'], 'value': key['target_value']},
+                'strength': int(bucket['strength']['value']),
+                'sentiment': bucket['sentiment']['value'] or 0
+            }
+        count += len(pairs['buckets'])
         
-        logger.info(f"Retrieved {len(relationships)} relationships from Elasticsearch")
-        return relationships
+        if len(pairs['buckets']) < page_size or 'after_key' not in pairs:
+            break
+        composite["after"] = pairs['after_key']
     
-    except Exception as e:
-        logger.error(f"Error querying relationships from Elasticsearch: {str(e)}")
-        return []
+    logger.info(f"Aggregated {count} entity pairs from Elasticsearch in {pages} pages")
+
+def open_point_in_time(session, endpoint):
+    """Open a point in time on the relationships index, or return None if unsupported"""
+    response = session.post(
+        f"{endpoint}/relationships/_pit",
+        params={'keep_alive': ES_PIT_KEEP_ALIVE},
+        timeout=ES_TIMEOUT
+    )
+    if point_in_time_unsupported(response):
+        logger.warning("Point in time not supported, paging relationships without a consistent snapshot")
+        return None
+    response.raise_for_status()
+    return response.json()['id']
+
+def point_in_time_unsupported(response):
+    """Whether a _pit response shows the cluster has no point in time API.
+
+    Such clusters route the request elsewhere and reject it with 405, or
+    400 for an unknown endpoint or parameter. Any other failure, such as a
+    404 for a missing index, is an error.
+    """
+    if response.status_code == 405:
+        return True
+    if response.status_code != 400:
+        return False
+    reason = response.text.lower()
+    return any(text in reason for text in ('no handler found', 'unrecognized parameter', 'invalid_type_name'))
+
+def close_point_in_time(session, endpoint, pit_id):
+    """Release a point in time, logging failures"""
+    try:
+        session.delete(f"{endpoint}/_pit", json={'id': pit_id}, timeout=ES_TIMEOUT)
+    except requests.RequestException as e:
+        logger.warning(f"Error closing point in time: {str(e)}")
 
 def build_graph(relationships):
-    """Build a NetworkX graph from relationships"""
+    """Build a NetworkX graph from an iterable of relationships.
+
+    Relationships between the same pair of entities, in either direction,
+    are merged into one edge: strengths are summed and sentiments averaged
+    weighted by strength. Relationships of an entity with itself are
+    dropped, as in build_csr_graph.
+    """
     G = nx.Graph()
     
     # Add nodes and edges
@@ -140,52 +360,266 @@ def build_graph(relationships):
         if not G.has_node(target_value):
             G.add_node(target_value, type=target_type)
         
-        # Add edge with attributes
-        G.add_edge(
-            source_value, 
-            target_value, 
-            weight=rel['strength'],
-            sentiment=rel['sentiment']
-        )
+        if source_value == target_value:
+            continue
+        
+        # Add edge with attributes, merging repeated pairs
+        edge = G.get_edge_data(source_value, target_value)
+        if edge is None:
+            G.add_edge(
+                source_value, 
+                target_value, 
+                weight=rel['strength'],
+                sentiment=rel['sentiment']
+            )
+        else:
+            weight = edge['weight'] + rel['strength']
+            if weight:
+                edge['sentiment'] = (edge['sentiment'] * edge['weight'] + rel['sentiment'] * rel['strength']) / weight
+            edge['weight'] = weight
     
     logger.info(f"Built graph with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
     return G
 
-def generate_graph_analyses(graph, relationships):
+class CSRGraph:
+    """Undirected graph over interned entity values, stored as CSR matrices.
+
+    Node i is nodes[i] with entity type types[i]; weight holds the summed
+    strengths and sentiment the strength-weighted mean sentiment of each
+    edge, both symmetric. adjacency is the unweighted pattern.
+    """
+    
+    def __init__(self, nodes, types, weight, sentiment):
+        self.nodes = nodes
+        self.types = types
+        self.index = {node: i for i, node in enumerate(nodes)}
+        self.weight = weight
+        self.sentiment = sentiment
+        self.adjacency = sp.csr_matrix(
+            (np.ones(len(weight.indices)), weight.indices, weight.indptr), shape=weight.shape
+        )
+    
+    def number_of_nodes(self):
+        return len(self.nodes)
+    
+    def number_of_edges(self):
+        return self.weight.nnz // 2
+    
+    def neighbors(self, i):
+        return self.weight.indices[self.weight.indptr[i]:self.weight.indptr[i + 1]]
+    
+    def edges(self, ids=None):
+        """Yield (u, v, weight, sentiment) once per edge, u < v, optionally only between ids"""
+        # weight and sentiment share one sparsity pattern, so their data align
+        indptr = self.weight.indptr
+        indices = self.weight.indices.tolist()
+        weights = self.weight.data.tolist()
+        sentiments = self.sentiment.data.tolist()
+        keep = None if ids is None else set(ids)
+        for u in (range(len(self.nodes)) if ids is None else sorted(keep)):
+            for j in range(indptr[u], indptr[u + 1]):
+                v = indices[j]
+                if u < v and (keep is None or v in keep):
+                    yield u, v, weights[j], sentiments[j]
+
+def build_csr_graph(relationships):
+    """Build a CSRGraph from an iterable of relationships.
+
+    Repeated pairs are merged as in build_graph: strengths are summed and
+    sentiments averaged weighted by strength, and relationships of an
+    entity with itself are dropped.
+    """
+    index = {}
+    nodes = []
+    types = []
+    rows = array('l')
+    cols = array('l')
+    strengths = array('d')
+    weighted_sentiments = array('d')
+    
+    def intern(end):
+        i = index.get(end['value'])
+        if i is None:
+            i = index[end['value']] = len(nodes)
+            nodes.append(end['value'])
+            types.append(end['type'])
+        return i
+    
+    for rel in relationships:
+        u = intern(rel['source'])
+        v = intern(rel['target'])
+        if u == v:
+            continue
+        # Both directions, so the matrices come out symmetric
+        rows.extend((u, v))
+        cols.extend((v, u))
+        strengths.extend((rel['strength'],) * 2)
+        weighted_sentiments.extend((rel['strength'] * rel['sentiment'],) * 2)
+    
+    n = len(nodes)
+    rows = np.frombuffer(rows, dtype=np.int_) if rows else np.zeros(0, dtype=np.int_)
+    cols = np.frombuffer(cols, dtype=np.int_) if cols else np.zeros(0, dtype=np.int_)
+    # Duplicates are summed when converting to CSR
+    weight = sp.csr_matrix((np.frombuffer(strengths) if strengths else np.zeros(0), (rows, cols)), shape=(n, n))
+    sentiment = sp.csr_matrix((np.frombuffer(weighted_sentiments) if weighted_sentiments else np.zeros(0),
+                               (rows, cols)), shape=(n, n))
+    weight.sort_indices()
+    sentiment.sort_indices()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sentiment.data = np.where(weight.data != 0, sentiment.data / weight.data, 0.0)
+    
+    graph = CSRGraph(nodes, types, weight, sentiment)
+    logger.info(f"Built CSR graph with {graph.number_of_nodes()} nodes and {graph.number_of_edges()} edges")
+    return graph
+
+def graph_stats(graph):
+    """Return node, edge, component and density statistics of graph"""
+    if isinstance(graph, CSRGraph):
+        n = graph.number_of_nodes()
+        m = graph.number_of_edges()
+        return {
+            'nodes': n,
+            'edges': m,
+            'connected_components': int(connected_components(graph.adjacency, directed=False)[0]) if n else 0,
+            'density': 2 * m / (n * (n - 1)) if n > 1 else 0
+        }
+    return {
+        'nodes': graph.number_of_nodes(),
+        'edges': graph.number_of_edges(),
+        'connected_components': nx.number_connected_components(graph),
+        'density': nx.density(graph)
+    }
+
+def compute_degree(graph):
+    """Return degree centrality, as a dict or, for a CSRGraph, an array by node ID"""
+    if isinstance(graph, CSRGraph):
+        n = graph.number_of_nodes()
+        degrees = np.diff(graph.adjacency.indptr).astype(float)
+        return degrees / (n - 1) if n > 1 else np.ones(n)
+    return nx.degree_centrality(graph)
+
+def top_scores(graph, scores, limit=20):
+    """Return the [(node, score)] pairs with the highest scores, highest first"""
+    if isinstance(scores, dict):
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+    order = np.argsort(-scores, kind='stable')[:limit]
+    return [(graph.nodes[i], float(scores[i])) for i in order]
+
+def graph_components(graph):
+    """Return the connected components as lists of nodes (node IDs for a CSRGraph)"""
+    if isinstance(graph, CSRGraph):
+        count, labels = connected_components(graph.adjacency, directed=False)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(count + 1))
+        return [order[bounds[c]:bounds[c + 1]].tolist() for c in range(count)]
+    return [sorted(component, key=str) for component in nx.connected_components(graph)]
+
+def detect_communities(graph):
+    """Return communities, largest first, and the method used.
+
+    NetworkX graphs use greedy modularity. CSR graphs use seeded label
+    propagation, which is linear in the number of edges per round.
+    """
+    if not isinstance(graph, CSRGraph):
+        return list(nx.community.greedy_modularity_communities(graph)), 'greedy_modularity'
+    
+    n = graph.number_of_nodes()
+    indptr = graph.weight.indptr.tolist()
+    indices = graph.weight.indices.tolist()
+    weights = graph.weight.data.tolist()
+    labels = list(range(n))
+    order = list(range(n))
+    rng = random.Random(BETWEENNESS_SEED)
+    
+    for _ in range(50):
+        rng.shuffle(order)
+        changed = 0
+        for i in order:
+            start, end = indptr[i], indptr[i + 1]
+            if start == end:
+                continue
+            tally = {}
+            for j in range(start, end):
+                label = labels[indices[j]]
+                tally[label] = tally.get(label, 0) + weights[j]
+            best = max(tally.values())
+            if tally.get(labels[i]) == best:
+                continue
+            labels[i] = min(label for label, total in tally.items() if total == best)
+            changed += 1
+        if not changed:
+            break
+    
+    groups = {}
+    for i, label in enumerate(labels):
+        groups.setdefault(label, []).append(i)
+    return sorted(groups.values(), key=len, reverse=True), 'label_propagation'
+
+def community_members(graph, community):
+    """Return the entity values of a community"""
+    if isinstance(graph, CSRGraph):
+        return [graph.nodes[i] for i in community]
+    return list(community)
+
+def drawable_subgraph(graph, nodes=None):
+    """Return a NetworkX graph of nodes (all when None) for drawing, or None if too large.
+
+    For a CSRGraph, nodes are node IDs and only the induced subgraph is
+    converted to NetworkX.
+    """
+    if not isinstance(graph, CSRGraph):
+        return graph if nodes is None else graph.subgraph(nodes)
+    
+    count = graph.number_of_nodes() if nodes is None else len(nodes)
+    if count > DRAW_MAX_NODES:
+        logger.info(f"Not drawing a subgraph of {count} nodes, above DRAW_MAX_NODES")
+        return None
+    
+    G = nx.Graph()
+    for i in (range(count) if nodes is None else sorted(nodes)):
+        G.add_node(graph.nodes[i], type=graph.types[i])
+    for u, v, weight, sentiment in graph.edges(nodes):
+        G.add_edge(graph.nodes[u], graph.nodes[v], weight=weight, sentiment=sentiment)
+    return G
+
+def ego_subgraph(graph, node):
+    """Return the radius-1 ego network of node as a NetworkX graph, or None if too large"""
+    if not isinstance(graph, CSRGraph):
+        return nx.ego_graph(graph, node, radius=1)
+    i = graph.index[node]
+    return drawable_subgraph(graph, {i, *graph.neighbors(i).tolist()})
+
+def generate_graph_analyses(graph):
     """Generate various graph analyses and visualizations"""
     timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
     report_data = {
         'generated_at': datetime.utcnow().isoformat(),
-        'graph_stats': {
-            'nodes': graph.number_of_nodes(),
-            'edges': graph.number_of_edges(),
-            'connected_components': nx.number_connected_components(graph),
-            'density': nx.density(graph)
-        },
+        'graph_stats': graph_stats(graph),
         'centrality_measures': {},
+        'centrality_methods': {},
         'communities': [],
         'visualizations': []
     }
     
     # 1. Calculate centrality measures
-    degree_centrality = nx.degree_centrality(graph)
-    betweenness_centrality = nx.betweenness_centrality(graph)
-    eigenvector_centrality = nx.eigenvector_centrality(graph, max_iter=1000)
+    degree_centrality = compute_degree(graph)
+    betweenness_centrality, report_data['centrality_methods']['betweenness'] = compute_betweenness(graph)
+    eigenvector_centrality, report_data['centrality_methods']['eigenvector'] = compute_eigenvector(graph)
     
     # Add to report data
     report_data['centrality_measures'] = {
-        'degree_centrality': {node: round(value, 4) for node, value in sorted(degree_centrality.items(), key=lambda x: x[1], reverse=True)[:20]},
-        'betweenness_centrality': {node: round(value, 4) for node, value in sorted(betweenness_centrality.items(), key=lambda x: x[1], reverse=True)[:20]},
-        'eigenvector_centrality': {node: round(value, 4) for node, value in sorted(eigenvector_centrality.items(), key=lambda x: x[1], reverse=True)[:20]}
+        'degree_centrality': {node: round(value, 4) for node, value in top_scores(graph, degree_centrality)},
+        'betweenness_centrality': {node: round(value, 4) for node, value in top_scores(graph, betweenness_centrality)},
+        'eigenvector_centrality': {node: round(value, 4) for node, value in top_scores(graph, eigenvector_centrality)}
     }
     
     # 2. Community detection
     try:
-        communities = list(nx.community.greedy_modularity_communities(graph))
+        communities, report_data['community_method'] = detect_communities(graph)
         
         # Add to report data
         report_data['communities'] = [
-            {'id': i, 'size': len(community), 'members': list(community)[:20]}
+            {'id': i, 'size': len(community), 'members': community_members(graph, community)[:20]}
             for i, community in enumerate(communities)
         ]
         
@@ -193,7 +627,8 @@ def generate_graph_analyses(graph, relationships):
         vis_files = []
         
         # 3.1 Overall network visualization
-        file_path = generate_network_visualization(graph, f"full_network_{timestamp}.png")
+        full_network = drawable_subgraph(graph)
+        file_path = full_network and generate_network_visualization(full_network, f"full_network_{timestamp}.png")
         if file_path:
             vis_files.append({
                 'type': 'full_network',
@@ -205,7 +640,9 @@ def generate_graph_analyses(graph, relationships):
         # 3.2 Top communities visualization
         for i, community in enumerate(communities[:5]):  # Visualize top 5 communities
             if len(community) > 2:  # Only visualize communities with at least 3 members
-                subgraph = graph.subgraph(community)
+                subgraph = drawable_subgraph(graph, community)
+                if subgraph is None:
+                    continue
                 file_path = generate_network_visualization(
                     subgraph, 
                     f"community_{i}_{timestamp}.png",
@@ -221,10 +658,10 @@ def generate_graph_analyses(graph, relationships):
                     })
         
         # 3.3 Ego networks for top central nodes
-        top_nodes = sorted(degree_centrality.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_nodes = top_scores(graph, degree_centrality, limit=5)
         for node, centrality in top_nodes:
-            ego_network = nx.ego_graph(graph, node, radius=1)
-            if ego_network.number_of_nodes() > 2:
+            ego_network = ego_subgraph(graph, node)
+            if ego_network is not None and ego_network.number_of_nodes() > 2:
                 file_path = generate_network_visualization(
                     ego_network,
                     f"ego_network_{node[:20]}_{timestamp}.png",
@@ -245,12 +682,12 @@ def generate_graph_analyses(graph, relationships):
         logger.error(f"Error generating community detection and visualization: {str(e)}")
     
     # 4. Generate sentiment analysis
-    generate_sentiment_analysis(graph, relationships, report_data, timestamp)
+    generate_sentiment_analysis(graph, report_data, timestamp)
     
     # 5. Store report data
     report_key = f"graphs/poi_graph_analysis_{timestamp}.json"
     try:
-        s3.put_object(
+        get_s3_client().put_object(
             Bucket=REPORTS_BUCKET,
             Key=report_key,
             Body=json.dumps(report_data, indent=2),
@@ -260,6 +697,216 @@ def generate_graph_analyses(graph, relationships):
     except Exception as e:
         logger.error(f"Error storing POI graph analysis report: {str(e)}")
 
+def compute_betweenness(graph):
+    """Return normalized betweenness centrality and a description of how it was computed.
+
+    Connected components are processed separately and rescaled to the
+    normalization of the whole graph, so exact results equal
+    nx.betweenness_centrality. Sampled results estimate them from a seeded
+    sample of source nodes per component. The description includes an
+    additive error bound that holds for all nodes together with
+    BETWEENNESS_CONFIDENCE (Hoeffding with a union bound).
+    """
+    n = graph.number_of_nodes()
+    mode = BETWEENNESS_MODE
+    if mode == 'auto':
+        mode = 'exact' if n <= BETWEENNESS_EXACT_MAX_NODES else 'sampled'
+    
+    csr = isinstance(graph, CSRGraph)
+    betweenness = np.zeros(n) if csr else dict.fromkeys(graph, 0.0)
+    info = {
+        'mode': mode,
+        'workers': max(BETWEENNESS_WORKERS, 1),
+        'components': 0,
+        'sampled_components': 0,
+        'sources': 0,
+        'error_bound': 0.0,
+        'confidence': BETWEENNESS_CONFIDENCE
+    }
+    if mode == 'sampled':
+        info['seed'] = BETWEENNESS_SEED
+    if n <= 2:
+        return betweenness, info
+    
+    rng = random.Random(BETWEENNESS_SEED)
+    pairs = (n - 1) * (n - 2)
+    log_term = math.log(2 * n / (1 - BETWEENNESS_CONFIDENCE))
+    
+    for component in sorted(graph_components(graph), key=len, reverse=True):
+        size = len(component)
+        info['components'] += 1
+        if size <= 2:
+            continue
+        
+        nodes = component
+        sources = nodes
+        if mode == 'sampled':
+            k = min(size, max(1, round(BETWEENNESS_SAMPLES * size / n)))
+            if k < size:
+                sources = rng.sample(nodes, k)
+                info['sampled_components'] += 1
+                bound = (size - 1) * (size - 2) / pairs * math.sqrt(log_term / (2 * k))
+                info['error_bound'] = max(info['error_bound'], bound)
+        info['sources'] += len(sources)
+        
+        # Paths from a CSR source never leave its component, so the CSR
+        # graph is searched in place
+        subgraph = graph if csr or size == n else graph.subgraph(component)
+        partial = betweenness_from_sources(subgraph, sources, info['workers'])
+        
+        # Subset betweenness is half the sum of pair dependencies over the
+        # sources; scale it to all sources (a source is not its own
+        # intermediate) and normalize by the pairs of the whole graph
+        k = len(sources)
+        source_set = set(sources)
+        for node in nodes:
+            samples = k - 1 if node in source_set else k
+            if samples:
+                betweenness[node] = 2 * partial[node] * (size - 1) / samples / pairs
+    
+    info['error_bound'] = round(info['error_bound'], 6)
+    logger.info(f"Computed betweenness centrality: {json.dumps(info)}")
+    return betweenness, info
+
+def betweenness_from_sources(graph, sources, workers=1):
+    """Return unnormalized betweenness restricted to paths starting at sources.
+
+    With several workers the sources are split across processes, each
+    returning its partial sums through a pipe (Lambda has no /dev/shm, so
+    multiprocessing pools and queues are not available).
+    """
+    if workers <= 1 or len(sources) < 2 * workers:
+        return subset_betweenness(graph, sources)
+    
+    processes = []
+    for i in range(workers):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_betweenness_worker, args=(sender, graph, sources[i::workers]))
+        process.start()
+        sender.close()
+        processes.append((process, receiver))
+    
+    csr = isinstance(graph, CSRGraph)
+    totals = np.zeros(graph.number_of_nodes()) if csr else dict.fromkeys(graph, 0.0)
+    errors = []
+    for process, receiver in processes:
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = RuntimeError(f"betweenness worker {process.pid} exited without a result")
+        process.join()
+        if isinstance(result, Exception):
+            errors.append(result)
+            continue
+        if csr:
+            totals += result
+            continue
+        for node, value in result.items():
+            totals[node] += value
+    
+    if errors:
+        raise errors[0]
+    return totals
+
+def _betweenness_worker(conn, graph, sources):
+    """Send the subset betweenness of sources back through conn"""
+    try:
+        conn.send(subset_betweenness(graph, sources))
+    except Exception as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+def subset_betweenness(graph, sources):
+    """Return unnormalized betweenness over paths starting at sources, in one process"""
+    if isinstance(graph, CSRGraph):
+        return csr_betweenness(graph, sources)
+    return nx.betweenness_centrality_subset(graph, sources, list(graph), normalized=False)
+
+def csr_betweenness(graph, sources):
+    """Brandes' accumulation over breadth-first searches of a CSRGraph.
+
+    Returns an array by node ID with the same scale as
+    nx.betweenness_centrality_subset(normalized=False) on an undirected
+    graph, i.e. half the summed dependencies.
+    """
+    n = graph.number_of_nodes()
+    indptr = graph.adjacency.indptr.tolist()
+    indices = graph.adjacency.indices.tolist()
+    totals = [0.0] * n
+    
+    for s in sources:
+        sigma = {s: 1}
+        distance = {s: 0}
+        predecessors = {s: []}
+        order = []
+        queue = deque([s])
+        while queue:
+            v = queue.popleft()
+            order.append(v)
+            next_distance = distance[v] + 1
+            for w in indices[indptr[v]:indptr[v + 1]]:
+                if w not in distance:
+                    distance[w] = next_distance
+                    sigma[w] = 0
+                    predecessors[w] = []
+                    queue.append(w)
+                if distance[w] == next_distance:
+                    sigma[w] += sigma[v]
+                    predecessors[w].append(v)
+        
+        delta = dict.fromkeys(order, 0.0)
+        for w in reversed(order):
+            coefficient = (1 + delta[w]) / sigma[w]
+            for v in predecessors[w]:
+                delta[v] += sigma[v] * coefficient
+            if w != s:
+                totals[w] += delta[w]
+    
+    return np.array(totals) / 2
+
+def compute_eigenvector(graph):
+    """Return eigenvector centrality and a description of how it was computed"""
+    if not isinstance(graph, CSRGraph) and graph.number_of_nodes() <= EIGENVECTOR_EXACT_MAX_NODES:
+        return nx.eigenvector_centrality(graph, max_iter=1000), {'method': 'networkx'}
+    return sparse_eigenvector_centrality(graph)
+
+def sparse_eigenvector_centrality(graph, max_iter=1000, tol=1e-06):
+    """Eigenvector centrality by power iteration on a SciPy sparse adjacency matrix.
+
+    Follows nx.eigenvector_centrality: iterates x <- (A + I) x with
+    Euclidean normalization until the L1 change is below n * tol. If it
+    does not converge, the last iterate is returned and reported. For a
+    CSRGraph the scores are an array by node ID.
+    """
+    if isinstance(graph, CSRGraph):
+        nodes = None
+        n = graph.number_of_nodes()
+        adjacency = graph.adjacency
+    else:
+        nodes = list(graph)
+        n = len(nodes)
+        adjacency = nx.to_scipy_sparse_array(graph, nodelist=nodes, weight=None, format='csr')
+    
+    x = np.full(n, 1.0 / n)
+    converged = False
+    for iteration in range(1, max_iter + 1):
+        x_next = adjacency @ x + x
+        norm = np.linalg.norm(x_next) or 1.0
+        x_next /= norm
+        delta = np.abs(x_next - x).sum()
+        x = x_next
+        if delta < n * tol:
+            converged = True
+            break
+    
+    if not converged:
+        logger.warning(f"Eigenvector power iteration did not converge in {max_iter} iterations")
+    info = {'method': 'scipy_power_iteration', 'iterations': iteration, 'converged': converged}
+    if nodes is None:
+        return x, info
+    return dict(zip(nodes, x.tolist())), info
+
 def generate_network_visualization(graph, filename, title=None):
     """Generate network visualization and save to S3"""
     try:
@@ -331,7 +978,7 @@ def generate_network_visualization(graph, filename, title=None):
         
         # Upload to S3
         s3_key = f"graphs/{filename}"
-        s3.put_object(
+        get_s3_client().put_object(
             Bucket=REPORTS_BUCKET,
             Key=s3_key,
             Body=buf.getvalue(),
@@ -347,9 +994,33 @@ def generate_network_visualization(graph, filename, title=None):
         plt.close()
         return None
 
-def generate_sentiment_analysis(graph, relationships, report_data, timestamp):
-    """Generate sentiment analysis for entity relationships"""
+def graph_relationships(graph):
+    """Return the edges of graph as relationship dicts"""
+    if isinstance(graph, CSRGraph):
+        return [
+            {
+                'source': {'type': graph.types[u], 'value': graph.nodes[u]},
+                'target': {'type': graph.types[v], 'value': graph.nodes[v]},
+                'strength': weight,
+                'sentiment': sentiment
+            }
+            for u, v, weight, sentiment in graph.edges()
+        ]
+    return [
+        {
+            'source': {'type': graph.nodes[u].get('type'), 'value': u},
+            'target': {'type': graph.nodes[v].get('type'), 'value': v},
+            'strength': data.get('weight', 1),
+            'sentiment': data.get('sentiment', 0)
+        }
+        for u, v, data in graph.edges(data=True)
+    ]
+
+def generate_sentiment_analysis(graph, report_data, timestamp):
+    """Generate sentiment analysis for the relationships in graph"""
     try:
+        relationships = graph_relationships(graph)
+        
         # Create sentiment distribution data
         sentiment_ranges = {
             'very_negative': {'min': -1.0, 'max': -0.6, 'count': 0},
@@ -427,7 +1098,7 @@ def generate_sentiment_analysis(graph, relationships, report_data, timestamp):
         
         # Upload to S3
         s3_key = f"graphs/sentiment_distribution_{timestamp}.png"
-        s3.put_object(
+        get_s3_client().put_object(
             Bucket=REPORTS_BUCKET,
             Key=s3_key,
             Body=buf.getvalue(),
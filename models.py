@@ -0,0 +1,57 @@
+"""
+Database models, shared by the web app (app.py) and the Celery tasks
+(utils.py) without either importing the other.
+"""
+
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+
+db = SQLAlchemy()
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    password = db.Column(db.String(120), nullable=False)
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), default='pending')
+    input_source = db.Column(db.String(255))
+    output_destination = db.Column(db.String(255))
+    downloaded_bytes = db.Column(db.BigInteger, default=0)
+    download_size = db.Column(db.BigInteger)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def _not_postgresql(ddl, target, bind, dialect, **kw):
+    return dialect.name != 'postgresql'
+
+class Feature(db.Model):
+    # On PostgreSQL the table is LIST-partitioned by job_id, one partition per
+    # job (see utils.create_feature_partition). Unique constraints of a
+    # partitioned table must include job_id, so there (id, job_id) is unique
+    # and id is not a primary key of its own; elsewhere id is the primary key.
+    id = db.Column(db.Integer, nullable=False)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), nullable=False)
+    feature_type = db.Column(db.String(50))
+    value = db.Column(db.String(255))
+    offset = db.Column(db.BigInteger)
+    context = db.Column(db.Text)
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint('id').ddl_if(callable_=_not_postgresql),
+        db.UniqueConstraint('id', 'job_id').ddl_if(dialect='postgresql'),
+        # Keyset pagination of a job's features per type walks this index
+        db.Index('ix_feature_job_type_id', 'job_id', 'feature_type', 'id'),
+        # Per-type counts and top values group on these columns
+        db.Index('ix_feature_job_type_value', 'job_id', 'feature_type', 'value'),
+        {'postgresql_partition_by': 'LIST (job_id)'},
+    )
+
+class JobFeatureStats(db.Model):
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), primary_key=True)
+    feature_type = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+    distinct_values = db.Column(db.BigInteger)
+    top_values = db.Column(db.JSON)
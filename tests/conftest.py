@@ -0,0 +1,55 @@
+"""
+Fixtures for the tests of the web app and its Celery tasks. They run against
+an in-memory SQLite database.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+@pytest.fixture
+def app():
+    from app import app
+    from models import db
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def user(app):
+    from models import db, User
+
+    user = User(username='analyst', password='secret')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def client(app, user):
+    """A test client logged in as user"""
+    from app import login_manager
+    from models import db, User
+
+    login_manager.user_loader(lambda user_id: db.session.get(User, int(user_id)))
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+@pytest.fixture
+def job(app, user):
+    from models import db, Job
+
+    job = Job(user_id=user.id, input_source='upload', output_destination='analyst@example.com')
+    db.session.add(job)
+    db.session.commit()
+    return job
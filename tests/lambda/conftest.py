@@ -0,0 +1,36 @@
+"""
+Fixtures for the tests of the Lambda functions in lambda/, including a local
+HTTP server standing in for Elasticsearch.
+"""
+
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda'))
+
+@pytest.fixture
+def es_stub():
+    """Start stand-in Elasticsearch servers; es_stub(handler_class) returns (server, endpoint)"""
+    servers = []
+
+    def start(handler_class):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def session():
+    with requests.Session() as session:
+        yield session
@@ -0,0 +1,112 @@
+"""
+Tests of entity_processor.bulk_write against a stand-in for the Elasticsearch
+_bulk API: batching by count and size, splitting requests that are too
+large, retries of transiently rejected items and requests, permanent
+rejections and giving up.
+"""
+
+import json
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+import entity_processor
+
+class BulkHandler(BaseHTTPRequestHandler):
+    """Answers _bulk requests; the server's respond(ids, attempt) picks the statuses"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8').splitlines()
+        ids = [next(iter(json.loads(line).values()))['_id'] for line in lines[::2]]
+        self.server.requests.append(ids)
+        status, item_statuses = self.server.respond(ids, len(self.server.requests))
+
+        items = [
+            {'update': {'_index': 'entities', '_id': doc_id, 'status': item_status,
+                        **({'error': {'type': 'stub_error'}} if item_status >= 300 else {})}}
+            for doc_id, item_status in zip(ids, item_statuses)
+        ]
+        body = json.dumps({'errors': any(s >= 300 for s in item_statuses), 'items': items}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(entity_processor, 'ES_BULK_BACKOFF', 0)
+
+@pytest.fixture
+def bulk(es_stub, session):
+    """bulk(respond, count=7, ...) writes count actions to a stub answering with respond.
+
+    Returns (stats, the ids of each request).
+    """
+    def write(respond, count=7, batch_size=3, max_bytes=None):
+        server, endpoint = es_stub(BulkHandler)
+        server.respond = respond
+        actions = [({'update': {'_index': 'entities', '_id': f'doc{i}'}}, {'doc': {'n': i}}) for i in range(count)]
+        try:
+            return entity_processor.bulk_write(actions, batch_size, endpoint, session, max_bytes), server.requests
+        except Exception as e:
+            e.requests = server.requests
+            raise
+    return write
+
+def test_batches_of_batch_size_are_all_indexed(bulk):
+    stats, sent = bulk(lambda ids, attempt: (200, [201] * len(ids)))
+    assert stats['indexed'] == 7
+    assert [len(ids) for ids in sent] == [3, 3, 1]
+
+def test_batches_are_cut_at_max_bytes(bulk):
+    stats, sent = bulk(lambda ids, attempt: (200, [201] * len(ids)), max_bytes=200)
+    assert stats['indexed'] == 7
+    assert [len(ids) for ids in sent] == [2, 2, 2, 1]
+
+def test_item_rejected_with_429_is_resent_alone(bulk):
+    stats, sent = bulk(lambda ids, attempt: (200, [429 if attempt == 1 and i == 'doc1' else 200 for i in ids]))
+    assert stats['indexed'] == 7
+    assert stats['retried'] == 1
+    assert sent[1] == ['doc1']
+
+def test_item_rejected_with_400_is_counted_as_failed(bulk):
+    stats, sent = bulk(lambda ids, attempt: (200, [400 if i == 'doc4' else 200 for i in ids]))
+    assert stats['failed'] == 1
+    assert stats['indexed'] == 6
+    assert len(sent) == 3
+
+def test_request_rejected_with_503_is_resent(bulk):
+    stats, sent = bulk(lambda ids, attempt: (503 if attempt == 1 else 200, [200] * len(ids)))
+    assert stats['indexed'] == 7
+    assert sent[0] == sent[1]
+
+def test_request_rejected_with_413_is_split_until_it_fits(bulk):
+    stats, sent = bulk(lambda ids, attempt: (413 if len(ids) > 1 else 200, [201] * len(ids)))
+    assert stats['indexed'] == 7
+    assert stats['failed'] == 0
+    assert sent[:5] == [['doc0', 'doc1', 'doc2'], ['doc0'], ['doc1', 'doc2'], ['doc1'], ['doc2']]
+
+def test_single_action_rejected_with_413_raises(bulk):
+    with pytest.raises(requests.HTTPError) as error:
+        bulk(lambda ids, attempt: (413, [200] * len(ids)), batch_size=1)
+    assert len(error.value.requests) == 1
+
+def test_request_rejected_with_400_raises_without_retrying(bulk):
+    with pytest.raises(requests.HTTPError) as error:
+        bulk(lambda ids, attempt: (400, [200] * len(ids)))
+    assert len(error.value.requests) == 1
+
+def test_items_still_rejected_after_the_retries_raise(bulk):
+    with pytest.raises(RuntimeError) as error:
+        bulk(lambda ids, attempt: (200, [429 if i == 'doc0' else 200 for i in ids]))
+    assert len(error.value.requests) == entity_processor.ES_BULK_MAX_RETRIES + 1
+
+def test_unreachable_endpoint_raises_after_the_retries(session):
+    with pytest.raises(RuntimeError):
+        entity_processor.bulk_write([({'index': {'_index': 'entities', '_id': 'x'}}, {})],
+                                    endpoint='http://127.0.0.1:9', session=session)
@@ -0,0 +1,113 @@
+"""
+Tests of poi_graph_generator.iter_relationships against a stand-in for the
+Elasticsearch search, count and point in time APIs.
+"""
+
+import json
+import logging
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+import poi_graph_generator
+
+def relationship(i, pair_id=True):
+    source = {
+        'source': {'type': 'email', 'value': f'user{i}@example.com'},
+        'target': {'type': 'ip_address', 'value': f'10.0.0.{i % 5}'},
+        'strength': 1 + i % 3,
+        'sentiment': 0.0,
+    }
+    if pair_id:
+        source['pair_id'] = f'pair{i:03d}'
+    return source
+
+# Relationships indexed before pair_id was stored come last
+DOCUMENTS = [relationship(i) for i in range(23)] + [relationship(i, pair_id=False) for i in range(23, 30)]
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """Serves DOCUMENTS; server.pit picks whether the point in time API exists"""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        return json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+    def do_DELETE(self):
+        self.server.requests.append(('DELETE', self.path, self.read_body()))
+        self.reply(200, {'succeeded': True})
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        body = self.read_body()
+        self.server.requests.append(('POST', path, body))
+        if path == '/relationships/_pit':
+            if self.server.pit == 'missing':
+                return self.reply(404, {'error': {'type': 'index_not_found_exception'}, 'status': 404})
+            if not self.server.pit:
+                return self.reply(400, {'error': {
+                    'type': 'illegal_argument_exception',
+                    'reason': 'request [/relationships/_pit] contains unrecognized parameter: [keep_alive]'
+                }, 'status': 400})
+            return self.reply(200, {'id': 'pit-1'})
+        if path == '/relationships/_count':
+            return self.reply(200, {'count': sum(1 for doc in DOCUMENTS if 'pair_id' not in doc)})
+
+        sort = next(iter(body['sort'][0]))
+        if sort == '_shard_doc':
+            hits = [(i, doc) for i, doc in enumerate(DOCUMENTS)]
+        else:
+            # The query filters on exists: pair_id
+            hits = sorted((doc['pair_id'], doc) for doc in DOCUMENTS if 'pair_id' in doc)
+        if 'search_after' in body:
+            hits = [(key, doc) for key, doc in hits if key > body['search_after'][0]]
+        hits = hits[:body['size']]
+        self.reply(200, {
+            'pit_id': body.get('pit', {}).get('id'),
+            'hits': {'hits': [{'_source': doc, 'sort': [key]} for key, doc in hits]}
+        })
+
+@pytest.fixture
+def search(es_stub, session):
+    """search(pit) returns (relationships, requests) of one iter_relationships run"""
+    def run(pit):
+        server, endpoint = es_stub(SearchHandler)
+        server.pit = pit
+        relationships = list(poi_graph_generator.iter_relationships(
+            page_size=10, endpoint=endpoint, session=session
+        ))
+        return relationships, server.requests
+    return run
+
+def test_pages_within_a_point_in_time_on_shard_doc(search):
+    relationships, sent = search(pit=True)
+    assert relationships == DOCUMENTS
+    searches = [body for method, path, body in sent if path == '/_search']
+    # Three full pages, then an empty one
+    assert len(searches) == 4
+    assert all(body['sort'] == [{'_shard_doc': 'asc'}] for body in searches)
+    assert sent[-1][:2] == ('DELETE', '/_pit')
+
+def test_pages_on_pair_id_without_point_in_time(search, caplog):
+    with caplog.at_level(logging.WARNING):
+        relationships, sent = search(pit=False)
+    assert [r['pair_id'] for r in relationships] == [f'pair{i:03d}' for i in range(23)]
+    searches = [body for method, path, body in sent if path == '/relationships/_search']
+    assert len(searches) == 3
+    assert searches[0]['sort'] == [{'pair_id': {'order': 'asc', 'unmapped_type': 'keyword'}}]
+    assert {'exists': {'field': 'pair_id'}} in searches[0]['query']['bool']['filter']
+    assert 'Skipping 7 relationships indexed without pair_id' in caplog.text
+
+def test_missing_index_is_an_error(search):
+    with pytest.raises(requests.HTTPError):
+        search(pit='missing')
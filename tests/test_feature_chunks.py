@@ -0,0 +1,64 @@
+"""
+Tests of splitting bulk_extractor feature files into line-aligned chunks
+for the parse tasks, and of parsing the rows of a chunk.
+"""
+
+import utils
+
+FEATURES = b''.join(
+    b'%d\tuser%d@example.com\tcontext of feature %d\n' % (1000 + i * 37, i, i)
+    for i in range(200)
+)
+
+def write_output(tmp_path):
+    (tmp_path / 'email.txt').write_bytes(b'# BANNER\n# bulk_extractor version: 2.0\n' + FEATURES)
+    (tmp_path / 'email_histogram.txt').write_bytes(b'n=3\tuser1@example.com\n')
+    (tmp_path / 'report.xml').write_bytes(b'<dfxml/>')
+    return tmp_path
+
+def test_chunks_are_line_aligned_and_cover_the_file(tmp_path):
+    output = write_output(tmp_path)
+    data = (output / 'email.txt').read_bytes()
+
+    chunks = utils.plan_feature_chunks(str(output), chunk_bytes=1000)
+
+    assert len(chunks) > 1
+    assert all(path == str(output / 'email.txt') and feature_type == 'email'
+               for path, feature_type, _, _ in chunks)
+    assert chunks[0][2] == 0
+    assert chunks[-1][3] == len(data)
+    for (_, _, _, end), (_, _, start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+    for _, _, start, end in chunks:
+        assert end - start >= 1000 or end == len(data)
+        assert data[end - 1:end] == b'\n'
+
+def test_histograms_are_not_planned_as_features(tmp_path):
+    chunks = utils.plan_feature_chunks(str(write_output(tmp_path)), chunk_bytes=1000)
+    assert {feature_type for _, feature_type, _, _ in chunks} == {'email'}
+
+def test_small_files_are_one_chunk(tmp_path):
+    output = write_output(tmp_path)
+    assert utils.plan_feature_chunks(str(output)) == [
+        (str(output / 'email.txt'), 'email', 0, (output / 'email.txt').stat().st_size)
+    ]
+
+def test_chunks_yield_every_row_once(tmp_path):
+    output = write_output(tmp_path)
+    rows = [
+        row
+        for path, feature_type, start, end in utils.plan_feature_chunks(str(output), chunk_bytes=1000)
+        for row in utils.iter_feature_rows(path, feature_type, 7, start, end)
+    ]
+    assert rows == [
+        (7, 'email', f'user{i}@example.com', 1000 + i * 37, f'context of feature {i}')
+        for i in range(200)
+    ]
+
+def test_rows_take_the_numeric_offset_of_forensic_paths(tmp_path):
+    path = tmp_path / 'email.txt'
+    path.write_bytes(b'# BANNER\n5120-GZIP-36\talice@example.com\tctx\n77\tbob@example.com\n')
+    assert list(utils.iter_feature_rows(str(path), 'email', 1)) == [
+        (1, 'email', 'alice@example.com', 5120, 'ctx'),
+        (1, 'email', 'bob@example.com', 77, ''),
+    ]
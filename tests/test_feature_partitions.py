@@ -0,0 +1,116 @@
+"""
+Tests of the per-job Feature partitions and of the migrations run by
+utils.initialize(). The PostgreSQL tests need an empty scratch database named
+by TEST_POSTGRESQL_URL and are skipped without one.
+"""
+
+import os
+
+import pytest
+from flask import Flask
+
+from models import db, Feature, Job, JobFeatureStats, User
+from utils import add_job_columns, create_feature_partition, drop_job_features, partition_feature_table
+
+POSTGRESQL_URL = os.environ.get('TEST_POSTGRESQL_URL')
+
+def add_features(job_id, count, first_id=0):
+    db.session.add_all(
+        Feature(id=first_id + i, job_id=job_id, feature_type='email', value=f'v{i}', offset=i, context='')
+        for i in range(count)
+    )
+    db.session.commit()
+
+def test_partitioning_is_a_no_op_on_sqlite(app, job):
+    create_feature_partition(job.id)
+    partition_feature_table()
+    assert db.inspect(db.engine).get_table_names() == sorted(db.metadata.tables)
+
+def test_drop_job_features_on_sqlite(app, user, job):
+    other = Job(user_id=user.id)
+    db.session.add(other)
+    db.session.commit()
+    add_features(job.id, 3)
+    add_features(other.id, 2, first_id=10)
+    db.session.add(JobFeatureStats(job_id=job.id, feature_type='email', count=3))
+    db.session.commit()
+
+    drop_job_features(job.id)
+
+    assert Feature.query.filter_by(job_id=job.id).count() == 0
+    assert JobFeatureStats.query.filter_by(job_id=job.id).count() == 0
+    assert Feature.query.filter_by(job_id=other.id).count() == 2
+
+def test_add_job_columns_to_legacy_table(app):
+    with db.engine.begin() as conn:
+        conn.execute(db.text('DROP TABLE job'))
+        conn.execute(db.text(
+            'CREATE TABLE job (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, status VARCHAR(20), '
+            'input_source VARCHAR(255), output_destination VARCHAR(255))'
+        ))
+        conn.execute(db.text("INSERT INTO job (id, user_id, status) VALUES (1, 1, 'completed')"))
+
+    add_job_columns()
+    add_job_columns()
+
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('job')}
+    assert columns == set(Job.__table__.c.keys())
+    job = db.session.get(Job, 1)
+    assert job.created_at is not None
+    assert job.downloaded_bytes is None
+
+@pytest.fixture
+def postgresql_app():
+    if not POSTGRESQL_URL:
+        pytest.skip('TEST_POSTGRESQL_URL is not set')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = POSTGRESQL_URL
+    db.init_app(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        with db.engine.begin() as conn:
+            conn.execute(db.text('DROP TABLE IF EXISTS job_feature_stats, feature, job, "user" CASCADE'))
+
+def test_partition_legacy_feature_table(postgresql_app):
+    User.__table__.create(db.engine)
+    Job.__table__.create(db.engine)
+    with db.engine.begin() as conn:
+        conn.execute(db.text(
+            'CREATE TABLE feature (id SERIAL PRIMARY KEY, job_id INTEGER NOT NULL REFERENCES job (id), '
+            'feature_type VARCHAR(50), value VARCHAR(255), "offset" BIGINT, context TEXT)'
+        ))
+        conn.execute(db.text('CREATE INDEX ix_feature_job_type_id ON feature (job_id, feature_type, id)'))
+        conn.execute(db.text("INSERT INTO \"user\" (id, username, password) VALUES (1, 'analyst', 'secret')"))
+        conn.execute(db.text('INSERT INTO job (user_id) VALUES (1), (1), (1)'))
+        conn.execute(db.text(
+            "INSERT INTO feature (job_id, feature_type, value, \"offset\", context) "
+            "SELECT 1 + g % 2, 'email', 'v' || g, g, '' FROM generate_series(1, 100) g"
+        ))
+    db.create_all()
+
+    partition_feature_table()
+    partition_feature_table()
+
+    with db.engine.connect() as conn:
+        assert conn.execute(db.text("SELECT relkind FROM pg_class WHERE relname = 'feature'")).scalar() == 'p'
+        partitions = conn.execute(db.text(
+            "SELECT relname FROM pg_inherits JOIN pg_class ON pg_class.oid = inhrelid "
+            "WHERE inhparent = 'feature'::regclass ORDER BY relname"
+        )).scalars().all()
+        assert partitions == ['feature_job_1', 'feature_job_2', 'feature_job_3']
+        counts = conn.execute(db.text('SELECT job_id, count(*), max(id) FROM feature GROUP BY job_id ORDER BY job_id')).all()
+        assert [tuple(row) for row in counts] == [(1, 50, 100), (2, 50, 99)]
+
+    # New rows continue the ids of the migrated ones
+    job = Job(user_id=1)
+    db.session.add(job)
+    db.session.commit()
+    create_feature_partition(job.id)
+    db.session.add(Feature(job_id=job.id, feature_type='email', value='new', offset=0, context=''))
+    db.session.commit()
+    assert Feature.query.filter_by(job_id=job.id).one().id == 101
+
+    drop_job_features(1)
+    assert Feature.query.filter_by(job_id=1).count() == 0
+    assert Feature.query.filter_by(job_id=2).count() == 50
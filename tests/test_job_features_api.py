@@ -0,0 +1,63 @@
+"""
+Tests of the feature browsing API, /api/jobs/<id>/features.
+"""
+
+from models import db, Feature, Job, User
+
+def add_features(job_id, feature_type, count, first_id=0):
+    db.session.add_all(
+        Feature(id=job_id * 1000 + first_id + i, job_id=job_id, feature_type=feature_type,
+                value=f'{feature_type}{i}', offset=i * 10, context='ctx')
+        for i in range(count)
+    )
+    db.session.commit()
+
+def test_pages_are_keyset_paginated_on_id(client, job):
+    add_features(job.id, 'email', 25)
+    add_features(job.id, 'url', 3, first_id=100)
+
+    values = []
+    after = 0
+    pages = 0
+    while after is not None:
+        response = client.get(f'/api/jobs/{job.id}/features', query_string={'type': 'email', 'after': after, 'limit': 10})
+        assert response.status_code == 200
+        page = response.get_json()
+        values.extend(feature['value'] for feature in page['features'])
+        after = page['next_after']
+        pages += 1
+
+    assert values == [f'email{i}' for i in range(25)]
+    assert pages == 3
+
+def test_last_full_page_has_no_next(client, job):
+    add_features(job.id, 'email', 10)
+    page = client.get(f'/api/jobs/{job.id}/features', query_string={'type': 'email', 'limit': 10}).get_json()
+    assert len(page['features']) == 10
+    assert page['next_after'] is None
+
+def test_features_carry_their_offset_and_context(client, job):
+    add_features(job.id, 'email', 2)
+    page = client.get(f'/api/jobs/{job.id}/features', query_string={'type': 'email'}).get_json()
+    assert page['features'][1] == {'id': job.id * 1000 + 1, 'value': 'email1', 'offset': 10, 'context': 'ctx'}
+
+def test_limit_is_clamped(client, job, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'FEATURE_PAGE_SIZE_MAX', 5)
+    add_features(job.id, 'email', 8)
+
+    page = client.get(f'/api/jobs/{job.id}/features', query_string={'type': 'email', 'limit': 100}).get_json()
+    assert len(page['features']) == 5
+    page = client.get(f'/api/jobs/{job.id}/features', query_string={'type': 'email', 'limit': 0}).get_json()
+    assert len(page['features']) == 1
+
+def test_other_users_jobs_are_not_found(client, job):
+    other = User(username='other', password='secret')
+    db.session.add(other)
+    db.session.commit()
+    other_job = Job(user_id=other.id, input_source='upload', output_destination='other@example.com')
+    db.session.add(other_job)
+    db.session.commit()
+    add_features(other_job.id, 'email', 3)
+
+    assert client.get(f'/api/jobs/{other_job.id}/features', query_string={'type': 'email'}).status_code == 404
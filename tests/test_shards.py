@@ -0,0 +1,60 @@
+"""
+Tests of splitting large inputs into bulk_extractor shards and merging the
+shard outputs back into one set of feature files.
+"""
+
+import utils
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+def test_plan_shards_covers_the_input_once():
+    shards = utils.plan_shards(250, shard_bytes=100, overlap=10)
+    assert shards == [(0, 100, 110), (100, 200, 210), (200, 250, 250)]
+
+def test_plan_shards_of_a_small_input_is_one_shard():
+    assert utils.plan_shards(50, shard_bytes=100, overlap=10) == [(0, 50, 50)]
+    assert utils.plan_shards(0, shard_bytes=100, overlap=10) == []
+
+def test_feature_line_offset_reads_the_leading_number():
+    assert utils.feature_line_offset(b'1234\tbob@example.com\tctx\n') == 1234
+    assert utils.feature_line_offset(b'1234-GZIP-56\tbob@example.com\tctx\n') == 1234
+    assert utils.feature_line_offset(b'# banner\n') is None
+
+def test_merge_keeps_each_feature_from_the_shard_owning_its_offset(tmp_path):
+    # bob@example.com at offset 120 lies in shard 0's overlap and is found by both shards
+    write(tmp_path / 's0' / 'email.txt', b'# BANNER\n10\talice@example.com\tctx\n120\tbob@example.com\tctx\n')
+    write(tmp_path / 's1' / 'email.txt', b'# BANNER\n120\tbob@example.com\tctx\n150\talice@example.com\tctx\n')
+    output = tmp_path / 'out'
+    output.mkdir()
+
+    utils.merge_shard_outputs([(str(tmp_path / 's0'), 0, 100), (str(tmp_path / 's1'), 100, 200)], str(output))
+
+    assert (output / 'email.txt').read_bytes() == (
+        b'# BANNER\n10\talice@example.com\tctx\n120\tbob@example.com\tctx\n150\talice@example.com\tctx\n'
+    )
+
+def test_merge_rebuilds_histograms_from_the_merged_features(tmp_path):
+    write(tmp_path / 's0' / 'email.txt', b'10\talice@example.com\tctx\n120\tbob@example.com\tctx\n')
+    write(tmp_path / 's0' / 'email_histogram.txt', b'n=1\talice@example.com\nn=1\tbob@example.com\n')
+    write(tmp_path / 's1' / 'email.txt', b'120\tbob@example.com\tctx\n150\talice@example.com\tctx\n')
+    write(tmp_path / 's1' / 'email_histogram.txt', b'n=1\tbob@example.com\nn=1\talice@example.com\n')
+    output = tmp_path / 'out'
+    output.mkdir()
+
+    utils.merge_shard_outputs([(str(tmp_path / 's0'), 0, 100), (str(tmp_path / 's1'), 100, 200)], str(output))
+
+    # The overlap copy of bob@example.com is not counted twice
+    assert (output / 'email_histogram.txt').read_bytes() == b'n=2\talice@example.com\nn=1\tbob@example.com\n'
+
+def test_merge_sums_histograms_without_a_feature_file(tmp_path):
+    write(tmp_path / 's0' / 'url_domain_histogram.txt', b'n=2\texample.com\n')
+    write(tmp_path / 's1' / 'url_domain_histogram.txt', b'n=1\texample.com\nn=1\texample.org\n')
+    output = tmp_path / 'out'
+    output.mkdir()
+
+    utils.merge_shard_outputs([(str(tmp_path / 's0'), 0, 100), (str(tmp_path / 's1'), 100, 200)], str(output))
+
+    assert (output / 'url_domain_histogram.txt').read_bytes() == b'n=3\texample.com\nn=1\texample.org\n'
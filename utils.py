@@ -1,26 +1,201 @@
-@celery.task
-def process_job(job_id, file_path_or_url):
-    job = Job.query.get(job_id)
-    import requests
-    import docker
-    import os
+import csv
+import io
+import logging
+import os
+import re
+import time
+
+from celery import chord, shared_task
+
+from models import db, Job, Feature, JobFeatureStats
+
+logger = logging.getLogger(__name__)
 
+# Number of feature rows sent to the database per COPY/executemany round trip
+FEATURE_BATCH_SIZE = 10000
+FEATURE_COLUMNS = ('job_id', 'feature_type', 'value', 'offset', 'context')
+FEATURE_COPY_COLUMNS = ('job_id', 'feature_type', 'value', '"offset"', 'context')
+# Feature files larger than this are split at line boundaries across parse tasks
+FEATURE_CHUNK_BYTES = 64 * 1024 * 1024
+# Inputs larger than this are processed by several bulk_extractor containers
+SHARD_BYTES = 4 * 1024 ** 3
+# Bytes each shard scans past its end so that boundary-straddling features are found whole
+SHARD_OVERLAP_BYTES = 16 * 1024 ** 2
+FEATURE_OFFSET_RE = re.compile(rb'(\d+)')
+# Evidence downloads are streamed to disk in chunks of this size
+DOWNLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# Servers that accept Range requests are fetched over this many parallel connections
+DOWNLOAD_PARALLEL_PARTS = 4
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_TIMEOUT = 60
+# Minimum seconds between download progress writes to the Job row
+DOWNLOAD_PROGRESS_INTERVAL = 2.0
+# Job columns added after the first release, created by add_job_columns on
+# databases that predate them, with the SQL value existing rows are given
+JOB_ADDED_COLUMNS = {
+    'downloaded_bytes': None,
+    'download_size': None,
+    # The templates show every job's creation time
+    'created_at': 'CURRENT_TIMESTAMP',
+}
+# Most frequent values listed per feature type in job reports
+REPORT_TOP_VALUES = 10
+# Rows fetched per round trip when a report streams individual features
+REPORT_STREAM_BATCH = 5000
+
+@shared_task
+def process_job(job_id, file_path_or_url):
     # Download file if URL is provided
     if file_path_or_url.startswith('http'):
         file_path = f'/tmp/job_{job_id}'
-        response = requests.get(file_path_or_url)
-        with open(file_path, 'wb') as f:
-            f.write(response.content)
+        download_evidence(file_path_or_url, file_path, job_id)
     else:
         file_path = file_path_or_url
 
-    # Run bulk_extractor in Docker
-    client = docker.from_env()
     output_dir = f'/tmp/output_{job_id}'
     os.makedirs(output_dir, exist_ok=True)
+
+    # Large inputs are split into byte-range shards, one bulk_extractor container each
+    size = os.path.getsize(file_path)
+    if size > SHARD_BYTES:
+        shards = plan_shards(size)
+        logger.info(f"Job {job_id}: running bulk_extractor over {len(shards)} shards")
+        chord(
+            run_extractor_shard.s(job_id, file_path, index, start, end, scan_end)
+            for index, (start, end, scan_end) in enumerate(shards)
+        )(merge_extractor_shards.s(job_id, output_dir))
+    else:
+        run_bulk_extractor(file_path, output_dir)
+        dispatch_feature_parsing(job_id, output_dir)
+
+def download_evidence(url, file_path, job_id=None, parallel=DOWNLOAD_PARALLEL_PARTS):
+    """Stream url to file_path in chunks, recording progress on the Job row.
+
+    Dropped connections are resumed with HTTP Range requests when the
+    server supports them. Such servers are also fetched with several
+    parallel ranged requests when the file is large enough.
+    """
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+
+    with requests.Session() as session:
+        head = session.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+        # A failed HEAD reports the length of its error body, not of the file;
+        # the file is then streamed in one request of unknown size
+        total = (int(head.headers.get('Content-Length', 0)) or None) if head.ok else None
+        resumable = head.ok and head.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        advance = download_progress_reporter(job_id, total)
+
+        with open(file_path, 'wb') as f:
+            if total:
+                f.truncate(total)
+
+        if resumable and total and parallel > 1 and total >= parallel * DOWNLOAD_CHUNK_BYTES:
+            part_size = -(-total // parallel)
+            ranges = [(start, min(start + part_size, total) - 1) for start in range(0, total, part_size)]
+            logger.info(f"Downloading {url} in {len(ranges)} parallel ranges")
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [
+                    executor.submit(fetch_range, session, url, file_path, start, end, resumable, advance)
+                    for start, end in ranges
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            fetch_range(session, url, file_path, 0, total - 1 if total else None, resumable, advance)
+
+        advance(0, force=True)
+
+def fetch_range(session, url, file_path, start, end, resumable, advance):
+    """Stream bytes start..end (inclusive, end None for unknown) of url into the same span of file_path"""
+    import requests
+
+    position = start
+    attempt = 0
+    while end is None or position <= end:
+        resumed_at = position
+        headers = {}
+        if resumable and (position > 0 or end is not None):
+            headers['Range'] = f"bytes={position}-{'' if end is None else end}"
+        error = None
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                if 'Range' in headers and response.status_code != 206:
+                    raise IOError(f"Server ignored Range request for {url}")
+                with open(file_path, 'r+b') as f:
+                    f.seek(position)
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                        f.write(chunk)
+                        position += len(chunk)
+                        advance(len(chunk))
+            if end is None:
+                return
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            error = e
+
+        # Only consecutive attempts without progress count against DOWNLOAD_RETRIES
+        progressed = resumable and position > resumed_at
+        if progressed:
+            attempt = 0
+        if error is None:
+            if position > end or progressed:
+                continue
+            # A response that ends early without adding bytes is a failed attempt too
+            error = IOError(f"Response ended at byte {position} of {end + 1}")
+
+        attempt += 1
+        if attempt > DOWNLOAD_RETRIES:
+            raise error
+        logger.warning(f"Download of {url} interrupted at byte {position} ({str(error)}), retry {attempt}/{DOWNLOAD_RETRIES}")
+        if not resumable:
+            # Without Range support the transfer has to start over
+            advance(start - position)
+            position = start
+        time.sleep(min(2 ** attempt, 30))
+
+def download_progress_reporter(job_id, total):
+    """Return an advance(nbytes, force=False) callback that records download progress.
+
+    Progress is written to the Job row at most every
+    DOWNLOAD_PROGRESS_INTERVAL seconds. The callback is thread-safe.
+    """
+    import threading
+
+    engine = db.engine if job_id is not None else None
+    lock = threading.Lock()
+    state = {'done': 0, 'reported_at': 0.0}
+
+    def advance(nbytes, force=False):
+        with lock:
+            state['done'] += nbytes
+            now = time.monotonic()
+            if engine is None or (not force and now - state['reported_at'] < DOWNLOAD_PROGRESS_INTERVAL):
+                return
+            state['reported_at'] = now
+            done = state['done']
+        with engine.begin() as conn:
+            conn.execute(
+                Job.__table__.update()
+                .where(Job.__table__.c.id == job_id)
+                .values(downloaded_bytes=done, download_size=total)
+            )
+
+    return advance
+
+def run_bulk_extractor(file_path, output_dir, scan_range=None):
+    """Run bulk_extractor in Docker, optionally restricted to a (start, end) byte range"""
+    import docker
+
+    command = '-o /output'
+    if scan_range:
+        command += f' -Y {scan_range[0]}-{scan_range[1]}'
+    command += ' /input/file'
+
+    client = docker.from_env()
     client.containers.run(
         'bulk_extractor_image',
-        command=f'-o /output /input/file',
+        command=command,
         volumes={
             file_path: {'bind': '/input/file', 'mode': 'ro'},
             output_dir: {'bind': '/output', 'mode': 'rw'}
@@ -28,29 +203,367 @@ def process_job(job_id, file_path_or_url):
         remove=True
     )
 
-    # Parse output
-    parse_feature_files(output_dir, job_id)
+def plan_shards(size, shard_bytes=SHARD_BYTES, overlap=SHARD_OVERLAP_BYTES):
+    """Split an input of size bytes into (start, end, scan_end) shards.
+
+    Each shard owns the features starting in [start, end) but scans up to
+    scan_end so that features straddling the boundary are seen whole.
+    """
+    shards = []
+    start = 0
+    while start < size:
+        end = min(start + shard_bytes, size)
+        shards.append((start, end, min(end + overlap, size)))
+        start = end
+    return shards
+
+def feature_line_offset(line):
+    """Return the absolute offset a feature line starts at, or None if it has none.
+
+    Offsets may be forensic paths such as 1234-GZIP-56, in which case the
+    leading number is the position of the containing object in the image.
+    """
+    match = FEATURE_OFFSET_RE.match(line)
+    return int(match.group(1)) if match else None
+
+def merge_shard_outputs(shard_results, output_dir):
+    """Merge per-shard feature files into output_dir.
+
+    bulk_extractor reports absolute image offsets under -Y, so merging only
+    has to keep each feature from the shard owning its offset; the copies
+    found again in a neighbouring shard's overlap are dropped. Histogram
+    files carry no offsets, so they are rebuilt from the merged feature
+    files instead (see write_feature_histogram).
+    """
+    filenames = sorted({
+        filename
+        for shard_dir, _, _ in shard_results
+        for filename in os.listdir(shard_dir)
+        if filename.endswith('.txt')
+    })
+
+    histograms = []
+    for filename in filenames:
+        shard_paths = [
+            (os.path.join(shard_dir, filename), start, end)
+            for shard_dir, start, end in shard_results
+            if os.path.exists(os.path.join(shard_dir, filename))
+        ]
+        if filename.endswith('_histogram.txt'):
+            histograms.append((filename, shard_paths))
+            continue
+
+        with open(os.path.join(output_dir, filename), 'wb') as out:
+            for index, (path, start, end) in enumerate(shard_paths):
+                with open(path, 'rb') as f:
+                    for line in f:
+                        if line.startswith(b'#'):
+                            # Keep the banner comments from one shard only
+                            if index == 0:
+                                out.write(line)
+                            continue
+                        offset = feature_line_offset(line)
+                        if offset is None or start <= offset < end:
+                            out.write(line)
+
+    for filename, shard_paths in histograms:
+        feature_path = os.path.join(output_dir, filename[:-len('_histogram.txt')] + '.txt')
+        if os.path.exists(feature_path):
+            write_feature_histogram(feature_path, os.path.join(output_dir, filename))
+        else:
+            logger.warning(f"No feature file for {filename}; summing shard histograms, "
+                           f"features in shard overlaps are counted twice")
+            merge_histogram_files([path for path, _, _ in shard_paths], os.path.join(output_dir, filename))
+
+def write_feature_histogram(feature_path, output_path):
+    """Write a bulk_extractor style histogram (n=<count> and value per line) of a feature file"""
+    from collections import Counter
+    counts = Counter()
+    with open(feature_path, 'rb') as f:
+        for line in f:
+            if feature_line_offset(line) is None:
+                continue
+            parts = line.rstrip(b'\n').split(b'\t')
+            if len(parts) >= 2:
+                counts[parts[1]] += 1
+    write_histogram(counts, output_path)
+
+def merge_histogram_files(paths, output_path):
+    """Sum the n=<count> lines of several bulk_extractor histogram files"""
+    from collections import Counter
+    counts = Counter()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                parts = line.rstrip(b'\n').split(b'\t', 1)
+                if len(parts) == 2 and parts[0].startswith(b'n='):
+                    counts[parts[1]] += int(parts[0][2:])
+    write_histogram(counts, output_path)
+
+def write_histogram(counts, output_path):
+    """Write a Counter of values as histogram lines, most frequent first"""
+    with open(output_path, 'wb') as out:
+        for value, count in counts.most_common():
+            out.write(b'n=%d\t%s\n' % (count, value))
+
+@shared_task
+def run_extractor_shard(job_id, file_path, index, start, end, scan_end):
+    """Run bulk_extractor over one shard and return (shard_dir, start, end)"""
+    shard_dir = f'/tmp/output_{job_id}_shard{index}'
+    os.makedirs(shard_dir, exist_ok=True)
+    run_bulk_extractor(file_path, shard_dir, (start, scan_end))
+    return (shard_dir, start, end)
+
+@shared_task
+def merge_extractor_shards(shard_results, job_id, output_dir):
+    """Merge the shard outputs of a job and hand the result to the parse stage"""
+    import shutil
+    merge_shard_outputs(shard_results, output_dir)
+    for shard_dir, _, _ in shard_results:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    dispatch_feature_parsing(job_id, output_dir)
+
+def dispatch_feature_parsing(job_id, output_dir):
+    """Parse output in parallel, one subtask per feature file chunk, then report"""
+    chunks = plan_feature_chunks(output_dir)
+    if chunks:
+        chord(parse_feature_chunk.s(job_id, *chunk) for chunk in chunks)(finalize_job.s(job_id))
+    else:
+        finalize_job.delay([], job_id)
+
+@shared_task
+def parse_feature_chunk(job_id, path, feature_type, start, end):
+    """Load one line-aligned byte range of a feature file into the Feature table"""
+    return load_feature_rows(iter_feature_rows(path, feature_type, job_id, start, end))
+
+@shared_task
+def finalize_job(chunk_stats, job_id):
+    """Generate and deliver the report once every parse chunk has been loaded"""
+    job = Job.query.get(job_id)
+    total = sum(stats['rows'] for stats in chunk_stats)
+    logger.info(f"Job {job_id}: loaded {total} features from {len(chunk_stats)} chunks")
 
-    # Generate and deliver report
+    refresh_job_feature_stats(job_id)
     report_path = generate_report(job_id)
     deliver_report(job, report_path)
     job.status = 'completed'
     db.session.commit()
 
-def generate_report(job_id):
-    job = Job.query.get(job_id)
-    features = Feature.query.filter_by(job_id=job_id).all()
-    from collections import Counter
-    feature_counts = Counter([f.feature_type for f in features])
-    report = f"Report for Job {job_id}\n"
-    report += f"Total features found: {len(features)}\n"
-    for ftype, count in feature_counts.items():
-        report += f"{ftype}: {count}\n"
+def generate_report(job_id, include_features=False):
+    """Write the text report for a job and return its path.
+
+    Counts and top values are read from JobFeatureStats, so report time
+    and memory depend on the number of feature types rather than rows. With
+    include_features every feature is listed as well, streamed through a
+    server-side cursor REPORT_STREAM_BATCH rows at a time.
+    """
+    stats = job_feature_stats(job_id)
+    feature_counts = {s.feature_type: s.count for s in stats}
+    top_values = {s.feature_type: s.top_values for s in stats if s.top_values}
+
     report_path = f'/tmp/report_{job_id}.txt'
     with open(report_path, 'w') as f:
-        f.write(report)
+        f.write(f"Report for Job {job_id}\n")
+        f.write(f"Total features found: {sum(feature_counts.values())}\n")
+        for ftype, count in feature_counts.items():
+            f.write(f"{ftype}: {count}\n")
+
+        for ftype, values in top_values.items():
+            f.write(f"\nTop {ftype} values:\n")
+            for value, count in values:
+                f.write(f"  {count}\t{value}\n")
+
+        if include_features:
+            rows = (
+                db.session.query(Feature.feature_type, Feature.offset, Feature.value)
+                .filter(Feature.job_id == job_id)
+                .order_by(Feature.feature_type, Feature.id)
+                .yield_per(REPORT_STREAM_BATCH)
+            )
+            current_type = None
+            for ftype, offset, value in rows:
+                if ftype != current_type:
+                    f.write(f"\n{ftype} features:\n")
+                    current_type = ftype
+                f.write(f"  {offset}\t{value}\n")
     return report_path
 
+def job_feature_stats(job_id):
+    """Return the JobFeatureStats rows of a job ordered by feature type"""
+    return JobFeatureStats.query.filter_by(job_id=job_id).order_by(JobFeatureStats.feature_type).all()
+
+def feature_type_counts(job_id):
+    """Return {feature_type: count} for a job from its JobFeatureStats rows"""
+    return {s.feature_type: s.count for s in job_feature_stats(job_id)}
+
+def feature_partition_name(job_id):
+    """Name of the Feature partition holding the rows of a job"""
+    return f'feature_job_{int(job_id)}'
+
+def feature_partition_ddl(job_id):
+    """Statement creating the Feature partition of a job if it does not exist"""
+    return db.text(
+        f'CREATE TABLE IF NOT EXISTS {feature_partition_name(job_id)} '
+        f'PARTITION OF feature FOR VALUES IN ({int(job_id)})'
+    )
+
+def create_feature_partition(job_id):
+    """Create the Feature partition for a job (PostgreSQL only)"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    db.session.execute(feature_partition_ddl(job_id))
+    db.session.commit()
+
+def initialize():
+    """Prepare the database for the tasks; run by celery_init.py after create_all"""
+    add_job_columns()
+    partition_feature_table()
+
+def add_job_columns():
+    """Add the Job columns introduced after the job table was first created.
+
+    create_all never alters an existing table, so older deployments lack
+    these columns and every Job query would fail on them.
+    """
+    with db.engine.begin() as conn:
+        existing = {column['name'] for column in db.inspect(conn).get_columns('job')}
+        for name, backfill in JOB_ADDED_COLUMNS.items():
+            if name in existing:
+                continue
+            column = Job.__table__.c[name]
+            # IF NOT EXISTS: the web and worker containers may both get here
+            if_not_exists = 'IF NOT EXISTS ' if conn.dialect.name == 'postgresql' else ''
+            conn.execute(db.text(
+                f'ALTER TABLE job ADD COLUMN {if_not_exists}{name} {column.type.compile(conn.dialect)}'
+            ))
+            if backfill:
+                conn.execute(db.text(f'UPDATE job SET {name} = {backfill} WHERE {name} IS NULL'))
+            logger.info(f"Added column job.{name}")
+
+def partition_feature_table():
+    """Migrate an unpartitioned PostgreSQL feature table to per-job partitions.
+
+    create_all never alters an existing table, so deployments created before
+    Feature was partitioned keep a plain heap table. Its rows are moved into
+    the partitioned layout, with a partition for every job, in a single
+    transaction. Every feature row is rewritten, so on a large table this
+    takes as long as copying it.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.begin() as conn:
+        # The web and worker containers both run celery_init.py at start
+        conn.execute(db.text("SELECT pg_advisory_xact_lock(hashtext('partition_feature_table'))"))
+        kind = conn.execute(db.text("SELECT relkind FROM pg_class WHERE oid = to_regclass('feature')")).scalar()
+        if kind != 'r':
+            return
+
+        logger.info("Migrating the feature table to per-job partitions")
+        conn.execute(db.text('ALTER TABLE feature RENAME TO feature_unpartitioned'))
+        conn.execute(db.text('ALTER SEQUENCE IF EXISTS feature_id_seq RENAME TO feature_unpartitioned_id_seq'))
+        for index in Feature.__table__.indexes:
+            conn.execute(db.text(f'DROP INDEX IF EXISTS {index.name}'))
+        Feature.__table__.create(conn)
+        for (job_id,) in conn.execute(db.text('SELECT id FROM job')).all():
+            conn.execute(feature_partition_ddl(job_id))
+
+        columns = ', '.join(('id',) + FEATURE_COPY_COLUMNS)
+        moved = conn.execute(db.text(
+            f'INSERT INTO feature ({columns}) SELECT {columns} FROM feature_unpartitioned'
+        )).rowcount
+        conn.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('feature', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM feature"
+        ))
+        conn.execute(db.text('DROP TABLE feature_unpartitioned'))
+    logger.info(f"Moved {moved} features into per-job partitions")
+
+def drop_job_features(job_id):
+    """Remove the features and statistics of a job.
+
+    On PostgreSQL this drops the job's partition instead of deleting rows,
+    so no dead tuples are left behind for VACUUM.
+    """
+    JobFeatureStats.query.filter_by(job_id=job_id).delete()
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text(f'DROP TABLE IF EXISTS {feature_partition_name(job_id)}'))
+    else:
+        Feature.query.filter_by(job_id=job_id).delete()
+    db.session.commit()
+
+def increment_feature_stats(conn, type_counts):
+    """Add {(job_id, feature_type): count} to JobFeatureStats.count with one upsert"""
+    if not type_counts:
+        return
+    table = JobFeatureStats.__table__
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.job_id, table.c.feature_type],
+        set_={'count': table.c.count + stmt.excluded['count']}
+    )
+    conn.execute(stmt, [
+        {'job_id': job_id, 'feature_type': feature_type, 'count': count}
+        for (job_id, feature_type), count in type_counts.items()
+    ])
+
+def refresh_job_feature_stats(job_id):
+    """Recompute the counts, distinct-value counts and top values of a job.
+
+    Runs once per job after ingestion; the aggregates are stored in
+    JobFeatureStats so that reports and pages never recount Feature rows.
+    """
+    rows = (
+        db.session.query(
+            Feature.feature_type,
+            db.func.count(Feature.id),
+            db.func.count(db.distinct(Feature.value))
+        )
+        .filter(Feature.job_id == job_id)
+        .group_by(Feature.feature_type)
+    )
+    top_values = top_feature_values(job_id)
+
+    JobFeatureStats.query.filter_by(job_id=job_id).delete()
+    for feature_type, count, distinct_values in rows:
+        db.session.add(JobFeatureStats(
+            job_id=job_id,
+            feature_type=feature_type,
+            count=count,
+            distinct_values=distinct_values,
+            top_values=[list(pair) for pair in top_values.get(feature_type, [])]
+        ))
+    db.session.commit()
+
+def top_feature_values(job_id, limit=REPORT_TOP_VALUES):
+    """Return {feature_type: [(value, count), ...]} with the most frequent values per type"""
+    count = db.func.count(Feature.id)
+    ranked = (
+        db.session.query(
+            Feature.feature_type,
+            Feature.value,
+            count.label('count'),
+            db.func.row_number().over(
+                partition_by=Feature.feature_type,
+                order_by=(count.desc(), Feature.value)
+            ).label('rank')
+        )
+        .filter(Feature.job_id == job_id)
+        .group_by(Feature.feature_type, Feature.value)
+        .subquery()
+    )
+    rows = (
+        db.session.query(ranked.c.feature_type, ranked.c.value, ranked.c.count)
+        .filter(ranked.c.rank <= limit)
+        .order_by(ranked.c.feature_type, ranked.c.rank)
+    )
+    top_values = {}
+    for ftype, value, value_count in rows:
+        top_values.setdefault(ftype, []).append((value, value_count))
+    return top_values
+
 def deliver_report(job, report_path):
     import requests
     import smtplib
@@ -71,17 +584,121 @@ def deliver_report(job, report_path):
             server.login('your_email@example.com', 'your_password')
             server.send_message(msg)
 
-def parse_feature_files(output_dir, job_id):
-    for filename in os.listdir(output_dir):
-        if filename.endswith('.txt'):
-            feature_type = filename.split('.')[0]
-            with open(os.path.join(output_dir, filename), 'r') as f:
-                for line in f:
-                    parts = line.strip().split('\t')
-                    if len(parts) >= 2:
-                        offset = parts[0]
-                        value = parts[1]
-                        context = parts[2] if len(parts) > 2 else ''
-                        feature = Feature(job_id=job_id, feature_type=feature_type, value=value, offset=offset, context=context)
-                        db.session.add(feature)
-    db.session.commit()
+def iter_feature_rows(path, feature_type, job_id, start=0, end=None):
+    """Yield a (job_id, feature_type, value, offset, context) row per feature line.
+
+    start and end restrict parsing to a byte range of the file; both must
+    fall on line boundaries (see plan_feature_chunks). The offset is the
+    leading number of the feature's forensic path (see feature_line_offset);
+    lines without one, such as banner comments, are skipped.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        for raw_line in f:
+            if end is not None and position >= end:
+                break
+            position += len(raw_line)
+            offset = feature_line_offset(raw_line)
+            if offset is None:
+                continue
+            parts = raw_line.decode('utf-8', errors='replace').strip().split('\t')
+            if len(parts) >= 2:
+                value = parts[1]
+                context = parts[2] if len(parts) > 2 else ''
+                yield (job_id, feature_type, value, offset, context)
+
+def is_feature_file(filename):
+    """Whether filename is a bulk_extractor feature file; histograms hold counts, not features"""
+    return filename.endswith('.txt') and not filename.endswith('_histogram.txt')
+
+def plan_feature_chunks(output_dir, chunk_bytes=FEATURE_CHUNK_BYTES):
+    """Split the feature files in output_dir into line-aligned byte ranges.
+
+    Returns a list of (path, feature_type, start, end) tuples, one per
+    parse task. Files smaller than chunk_bytes become a single range.
+    """
+    chunks = []
+    for filename in sorted(os.listdir(output_dir)):
+        if not is_feature_file(filename):
+            continue
+        path = os.path.join(output_dir, filename)
+        feature_type = filename.split('.')[0]
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            start = 0
+            while start < size:
+                end = min(start + chunk_bytes, size)
+                if end < size:
+                    # Move the split point forward to the next line boundary
+                    f.seek(end)
+                    f.readline()
+                    end = f.tell()
+                chunks.append((path, feature_type, start, end))
+                start = end
+    return chunks
+
+def iter_batches(rows, batch_size):
+    """Group an iterable of rows into lists of at most batch_size rows"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def copy_feature_batch(cursor, batch):
+    """Load one batch of feature rows through COPY FROM STDIN"""
+    buf = io.StringIO()
+    csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC).writerows(batch)
+    buf.seek(0)
+    cursor.copy_expert(
+        f'COPY feature ({", ".join(FEATURE_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)',
+        buf
+    )
+
+def load_feature_rows(rows, batch_size=FEATURE_BATCH_SIZE):
+    """Stream feature rows into the Feature table in fixed-size batches.
+
+    Uses PostgreSQL COPY when the driver supports it and falls back to a
+    batched executemany otherwise. Only one batch is held in memory at a
+    time, and everything is committed in a single transaction together
+    with the matching JobFeatureStats count increments.
+    """
+    from collections import Counter
+
+    started = time.monotonic()
+    total = 0
+    type_counts = Counter()
+    with db.engine.begin() as conn:
+        cursor = conn.connection.cursor()
+        use_copy = hasattr(cursor, 'copy_expert')
+        for batch in iter_batches(rows, batch_size):
+            if use_copy:
+                copy_feature_batch(cursor, batch)
+            else:
+                conn.execute(Feature.__table__.insert(), [dict(zip(FEATURE_COLUMNS, row)) for row in batch])
+            type_counts.update((row[0], row[1]) for row in batch)
+            total += len(batch)
+        increment_feature_stats(conn, type_counts)
+
+    elapsed = time.monotonic() - started
+    stats = {
+        'rows': total,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(total / elapsed, 1) if elapsed > 0 else float(total)
+    }
+    logger.info(f"Loaded {stats['rows']} features in {stats['seconds']}s ({stats['rows_per_sec']} rows/sec)")
+    return stats
+
+def parse_feature_files(output_dir, job_id, batch_size=FEATURE_BATCH_SIZE):
+    """Parse bulk_extractor feature files in output_dir and bulk load them for job_id"""
+    def rows():
+        for filename in sorted(os.listdir(output_dir)):
+            if is_feature_file(filename):
+                feature_type = filename.split('.')[0]
+                yield from iter_feature_rows(os.path.join(output_dir, filename), feature_type, job_id)
+
+    return load_feature_rows(rows(), batch_size)